@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import hashlib
+import argparse
+import multiprocessing
+import parse_packets
+import dataset_format
+
+CAPTURE_EXTENSIONS = ('.pcap', '.pcapng', '.cap')
+HASH_EXTENSION = '.sha256'
+
+
+def capture_hash(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_manifest(manifest_path):
+    """Reads '<capture> <output> [ipv4] [ipv6]' lines, '#' starts a comment"""
+    jobs = []
+    base = os.path.dirname(manifest_path)
+
+    with open(manifest_path) as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if len(fields) == 0:
+                continue
+            if len(fields) < 2:
+                print('ERROR: Invalid manifest line: {}'.format(line.strip()))
+                exit(1)
+            fields += [None] * (4 - len(fields))
+            jobs.append((os.path.join(base, fields[0]),
+                         os.path.join(base, fields[1]), fields[2], fields[3]))
+
+    return jobs
+
+
+def directory_jobs(capture_dir, output_dir, ipv4, ipv6, extension='.dat'):
+    jobs = []
+
+    for name in sorted(os.listdir(capture_dir)):
+        root, ext = os.path.splitext(name)
+        if ext.lower() not in CAPTURE_EXTENSIONS:
+            continue
+        jobs.append((os.path.join(capture_dir, name),
+                     os.path.join(output_dir, root + extension), ipv4, ipv6))
+
+    return jobs
+
+
+def up_to_date(capture_path, output_path, digest=None):
+    """Whether output_path is newer than the capture, or was converted from a
+    capture with this digest when one is given"""
+    if not os.path.exists(output_path):
+        return False
+
+    if digest is not None:
+        hash_path = output_path + HASH_EXTENSION
+        if not os.path.exists(hash_path):
+            return False
+        with open(hash_path) as f:
+            return f.read().strip() == digest
+
+    return os.path.getmtime(output_path) >= os.path.getmtime(capture_path)
+
+
+def convert(job):
+    capture_path, output_path, ipv4, ipv6, backend, force, use_hash = job
+    start = time.time()
+
+    # Checked in the worker, hashing every capture reads it whole
+    digest = capture_hash(capture_path) if use_hash else None
+    if not force and up_to_date(capture_path, output_path, digest):
+        return capture_path, output_path, None, time.time() - start
+
+    parse_packets.INFILE_PATH = capture_path
+    parse_packets.LOCAL_IP = ipv4
+    parse_packets.LOCAL_IPV6 = ipv6
+
+    timestamps, directions, sizes = parse_packets.packet_arrays(
+        parse_packets.read_packets(capture_path, backend))
+    bins = parse_packets.bin_packets(timestamps, directions, sizes)
+
+    # Never leave a half written output that would look up to date
+    root, ext = os.path.splitext(output_path)
+    tmp_path = root + '.tmp' + ext
+    parse_packets.save_to_file(bins, tmp_path)
+    os.replace(tmp_path, output_path)
+
+    if digest is not None:
+        with open(output_path + HASH_EXTENSION, 'w') as f:
+            f.write(digest + '\n')
+
+    return capture_path, output_path, bins.shape[0], time.time() - start
+
+
+def batch_convert(jobs, n_workers=None, backend='native', force=False,
+                  use_hash=False):
+    if len(jobs) == 0:
+        return []
+
+    for job in jobs:
+        output_dir = os.path.dirname(job[1])
+        if output_dir != '':
+            os.makedirs(output_dir, exist_ok=True)
+
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    n_workers = max(1, min(n_workers, len(jobs)))
+    results = []
+    start = time.time()
+
+    with multiprocessing.Pool(n_workers) as pool:
+        for done, result in enumerate(pool.imap_unordered(
+                convert, [(c, o, ipv4, ipv6, backend, force, use_hash)
+                          for c, o, ipv4, ipv6 in jobs]), 1):
+            capture_path, output_path, n_samples, elapsed = result
+            if n_samples is None:
+                continue
+            print('[{}/{}] {} -> {} ({} samples, {:.1f}s)'.format(
+                done, len(jobs), capture_path, output_path, n_samples,
+                elapsed))
+            sys.stdout.flush()
+            results.append(result)
+
+    print('{} captures, {} up to date, converted {} in {:.1f}s using {} '
+          'workers'.format(len(jobs), len(jobs) - len(results), len(results),
+                           time.time() - start, n_workers))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', nargs='?',
+            help='directory with capture files')
+    parser.add_argument('-m', '--manifest', nargs='?',
+            help='manifest file with "<capture> <output> [ipv4] [ipv6]" lines')
+    parser.add_argument('-o', '--output', nargs='?', default='datasets',
+            help='output directory for --input (default: datasets)')
+    parser.add_argument('-4', '--ipv4', nargs='?',
+            default=parse_packets.LOCAL_IP,
+            help='IPv4 of the host machine (default: {})'.format(
+                parse_packets.LOCAL_IP))
+    parser.add_argument('-6', '--ipv6', nargs='?',
+            default=parse_packets.LOCAL_IPV6,
+            help='IPv6 of the host machine (default: {})'.format(
+                parse_packets.LOCAL_IPV6))
+    parser.add_argument('-j', '--jobs', nargs='?', type=int,
+            help='number of worker processes (default: one per core)')
+    parser.add_argument('-b', '--backend', nargs='?', default='native',
+            choices=['native', 'pyshark'],
+            help='capture reader backend (default: native)')
+    parser.add_argument('-B', '--binary', action='store_true', default=False,
+            help='write binary datasets for --input (default: false)')
+    parser.add_argument('-f', '--force', action='store_true', default=False,
+            help='convert captures even if outputs are up to date')
+    parser.add_argument('-H', '--hash', action='store_true', default=False,
+            help='compare capture hashes instead of modification times')
+    args = parser.parse_args()
+
+    if (args.input is None) == (args.manifest is None):
+        print('ERROR: Use either an input directory or a manifest!')
+        exit(1)
+
+    if args.manifest is not None:
+        if not os.path.exists(args.manifest):
+            print('ERROR: Invalid manifest file!')
+            exit(1)
+        jobs = [(c, o, ipv4 or args.ipv4, ipv6 or args.ipv6)
+                for c, o, ipv4, ipv6 in read_manifest(args.manifest)]
+    else:
+        if not os.path.isdir(args.input):
+            print('ERROR: Invalid input directory!')
+            exit(1)
+        extension = dataset_format.BINARY_EXTENSION if args.binary else '.dat'
+        jobs = directory_jobs(args.input, args.output, args.ipv4, args.ipv6,
+                              extension)
+
+    for job in jobs:
+        if not os.path.exists(job[0]):
+            print('ERROR: Invalid input file {}!'.format(job[0]))
+            exit(1)
+
+    batch_convert(jobs, args.jobs, args.backend, args.force, args.hash)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import dataset_format
+import model_registry
+import profiling
+import scalogram
+import live_inference
+
+DATASETS_DIR = 'datasets'
+BASELINE_PATH = 'benchmark-baseline.json'
+REPEATS = 5
+# Fast stages are repeated until they ran for this long (seconds)
+MIN_STAGE_TIME = 1.0
+# Relative slowdown (or memory growth) flagged as a regression, if also more
+# than the absolute floors below
+TOLERANCE = 0.25
+TIME_FLOOR = 0.001  # seconds per pass over the datasets
+MEMORY_FLOOR = 1 << 20  # bytes
+SCALES = [2, 4]
+PERCENTILES = [50, 90, 99]
+
+
+def dataset_inputs(dataset_path):
+    """Inputs of every stage for one dataset, all of its windows as test"""
+    data = dataset_format.load_dataset(dataset_path)
+    windows = profiling.break_train_test(data, train_percentage=0.0,
+                                         random_split=False)[1]
+    empty_windows, features = profiling.extract_features(windows)
+    features_silence = profiling.extract_features_silence(windows,
+                                                          empty_windows)
+    features_wavelet = profiling.extract_features_wavelet(windows,
+                                                          empty_windows, SCALES)
+
+    return {
+        'path': os.path.normpath(dataset_path),
+        'data': data,
+        'windows': windows,
+        'empty_windows': empty_windows,
+        'series': windows[~empty_windows].transpose(0, 2, 1),
+        'live_features': np.hstack((features, features_silence,
+                                    features_wavelet)),
+    }
+
+
+def scalogram_chunks(series):
+    # Same chunks extract_features_wavelet transforms at once
+    for chunk in profiling.window_chunks(series.shape[0]):
+        scalogram.scalogramCWT(series[chunk], SCALES)
+
+
+def classify_normalized(live_features):
+    return live_inference.classify_live_data(
+        live_inference.normalize_live_features(live_features))
+
+
+# Stage: (function of the dataset inputs, groups of model artifacts it needs,
+# any one of each group)
+STAGES = {
+    'break_train_test': (
+        lambda i: profiling.break_train_test(
+            i['data'], train_percentage=0.0, random_split=False),
+        []),
+    'extract_features': (
+        lambda i: profiling.extract_features(i['windows']),
+        []),
+    'extract_features_silence': (
+        lambda i: profiling.extract_features_silence(
+            i['windows'], i['empty_windows']),
+        []),
+    'scalogramCWT': (
+        lambda i: scalogram_chunks(i['series']),
+        []),
+    'normalize_live_features': (
+        lambda i: live_inference.normalize_live_features(i['live_features']),
+        [(live_inference.PROJECTION_MODEL, live_inference.SCALER_MODEL)]),
+    'classify_live_data': (
+        lambda i: classify_normalized(i['live_features']),
+        [(live_inference.PROJECTION_MODEL, live_inference.SCALER_MODEL),
+         ('classification_model.npz', live_inference.CLASSIFICATION_MODEL)]),
+}
+
+
+def missing_models(stage):
+    return [group[-1] for group in STAGES[stage][1]
+            if not any(live_inference.model_exists(m) for m in group)]
+
+
+def run_stage(stage, inputs, repeats=REPEATS, min_time=MIN_STAGE_TIME):
+    """Times passes over all the inputs, at least repeats of them and for at
+    least min_time seconds, and the peak memory of a single call"""
+    func = STAGES[stage][0]
+    n_windows = sum(i['windows'].shape[0] for i in inputs)
+    latencies = []
+
+    func(inputs[0])  # warm up caches (filter banks, models)
+    start = time.perf_counter()
+    while len(latencies) < repeats * len(inputs) \
+            or time.perf_counter() - start < min_time:
+        for i in inputs:
+            call_start = time.perf_counter()
+            func(i)
+            latencies.append(time.perf_counter() - call_start)
+
+    # The fastest call on each dataset is the least disturbed by other
+    # processes
+    latencies = np.array(latencies).reshape((-1, len(inputs)))
+    best_pass = latencies.min(axis=0).sum()
+    # Latency of a window, datasets of different lengths are comparable
+    window_latencies = latencies / [i['windows'].shape[0] for i in inputs]
+
+    # Peak of the memory allocated by a single call, traced separately since
+    # tracing slows allocations down
+    peak = 0
+    for i in inputs:
+        tracemalloc.start()
+        func(i)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        'inputs': [[i['path'], i['windows'].shape[0]] for i in inputs],
+        'windows': n_windows,
+        'passes': latencies.shape[0],
+        'windows_per_sec': n_windows / best_pass,
+        'peak_memory': peak,
+        'window_latency_us': dict(zip(
+            ['p{}'.format(p) for p in PERCENTILES],
+            np.percentile(window_latencies * 1e6, PERCENTILES).tolist())),
+    }
+
+
+def regressions(results, baseline, tolerance=TOLERANCE,
+                time_floor=TIME_FLOOR, memory_floor=MEMORY_FLOOR):
+    found = []
+    for stage, r in results.items():
+        if stage not in baseline:
+            continue
+        b = baseline[stage]
+        # Time of the fastest pass over the datasets
+        pass_time = r['windows'] / r['windows_per_sec']
+        baseline_time = b['windows'] / b['windows_per_sec']
+        if pass_time > baseline_time * (1 + tolerance) \
+                and pass_time > baseline_time + time_floor:
+            found.append((stage, '{}: {:.0f} windows/s, baseline {:.0f}'
+                          .format(stage, r['windows_per_sec'],
+                                  b['windows_per_sec'])))
+        if r['peak_memory'] > b['peak_memory'] * (1 + tolerance) \
+                and r['peak_memory'] > b['peak_memory'] + memory_floor:
+            found.append((stage, '{}: {:.1f} MiB peak memory, baseline '
+                          '{:.1f}'.format(stage, r['peak_memory'] / (1 << 20),
+                                          b['peak_memory'] / (1 << 20))))
+    return found
+
+
+def best_result(a, b):
+    best = dict(a if a['windows_per_sec'] >= b['windows_per_sec'] else b)
+    best['peak_memory'] = min(a['peak_memory'], b['peak_memory'])
+    return best
+
+
+def print_results(results):
+    # Latency percentiles are per window, in microseconds
+    print('{:<26} {:>8} {:>12} {:>10} {:>9} {:>9} {:>9}'.format(
+        'Stage', 'Windows', 'Windows/s', 'Peak MiB', 'p50 us', 'p90 us',
+        'p99 us'))
+    for stage, r in results.items():
+        latency = r['window_latency_us']
+        print('{:<26} {:>8} {:>12.0f} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f}'
+              .format(stage, r['windows'], r['windows_per_sec'],
+                      r['peak_memory'] / (1 << 20), latency['p50'],
+                      latency['p90'], latency['p99']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', nargs='+', default=[DATASETS_DIR],
+            help='dataset file(s) or directories (default: {})'.format(
+                DATASETS_DIR))
+    parser.add_argument('-s', '--stages', nargs='+', default=list(STAGES),
+            choices=list(STAGES), help='stages to run (default: all)')
+    parser.add_argument('-r', '--repeats', nargs='?', type=int,
+            default=REPEATS,
+            help='minimum runs of each stage, fast stages run for at least '
+                 '{}s (default: {})'.format(MIN_STAGE_TIME, REPEATS))
+    parser.add_argument('-b', '--baseline', nargs='?', default=BASELINE_PATH,
+            help='baseline file (default: {})'.format(BASELINE_PATH))
+    parser.add_argument('-t', '--tolerance', nargs='?', type=float,
+            default=TOLERANCE,
+            help='relative slowdown or memory growth flagged as a '
+                 'regression (default: {})'.format(TOLERANCE))
+    parser.add_argument('-u', '--update', action='store_true', default=False,
+            help='save the results as the new baseline (default: false)')
+    parser.add_argument('-o', '--output', nargs='?',
+            help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    dataset_paths = []
+    for p in args.input:
+        if os.path.isdir(p):
+            dataset_paths += [os.path.join(p, f) for f in sorted(os.listdir(p))
+                              if f.endswith('.dat')]
+        elif os.path.exists(p):
+            dataset_paths.append(p)
+        else:
+            print('ERROR: Invalid input file {}!'.format(p))
+            exit(1)
+
+    if len(dataset_paths) == 0:
+        print('ERROR: No datasets to benchmark!')
+        exit(1)
+
+    inputs = [dataset_inputs(p) for p in dataset_paths]
+    results = {}
+
+    for stage in args.stages:
+        missing = missing_models(stage)
+        if len(missing) > 0:
+            print('Skipping {}, missing {} in {}'.format(
+                stage, ', '.join(missing), model_registry.MODEL_DIR))
+            continue
+        try:
+            results[stage] = run_stage(stage, inputs, args.repeats)
+        except Exception as e:
+            # Models saved by another version of scikit-learn may not load
+            if len(STAGES[stage][1]) == 0:
+                raise
+            print('Skipping {}, cannot load its models: {}'.format(stage, e))
+
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.update or len(baseline) == 0:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1)
+        print('Baseline saved to {}'.format(args.baseline))
+        return
+
+    # Pass times are only comparable on the same datasets
+    other_inputs = [stage for stage in results if stage in baseline and
+                    baseline[stage].get('inputs') != results[stage]['inputs']]
+    if len(other_inputs) > 0:
+        print('ERROR: Baseline of {} was measured on other datasets, use the '
+              'same input or update it (-u)!'.format(', '.join(other_inputs)))
+        exit(1)
+
+    found = regressions(results, baseline, args.tolerance)
+    if len(found) > 0:
+        # A real regression shows in a second run too, noise rarely does
+        for stage in sorted(set(stage for stage, _ in found)):
+            print('Running {} again'.format(stage))
+            results[stage] = best_result(
+                results[stage], run_stage(stage, inputs, args.repeats))
+        found = regressions(results, baseline, args.tolerance)
+    for _, r in found:
+        print('REGRESSION: {}'.format(r))
+    if len(found) > 0:
+        exit(1)
+    print('No regressions against {}'.format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
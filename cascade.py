@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def run_cascade(stages, features):
+    """Classifies the rows of features with a cascade of models.
+
+    Each stage is a dict with:
+      'model': fitted model, anything with a predict method;
+      'columns': slice (or index array) of the feature columns it uses;
+      'route' (optional): predicate on the current labels of every row,
+        the rows it is true for are (re)classified by this stage. A stage
+        without one classifies every row;
+      'post' (optional): function applied to all labels after the stage.
+
+    Stages only see the rows routed to them, so an expensive later stage
+    costs as much as the fraction of rows it is given.
+    """
+    features = np.asarray(features)
+    labels = None
+
+    for stage in stages:
+        columns = stage.get('columns', slice(None))
+        if 'route' in stage and labels is not None:
+            rows = np.flatnonzero(stage['route'](labels))
+            # Only the routed rows and the stage's columns are gathered
+            x = features[rows, columns] if isinstance(columns, slice) \
+                else features[np.ix_(rows, columns)]
+        else:
+            # Every row, a view when the columns are a slice
+            rows = slice(None)
+            x = features[:, columns]
+
+        if x.shape[0] > 0:
+            result = np.asarray(stage['model'].predict(x))
+            if labels is None:
+                labels = np.empty(features.shape[0], dtype=result.dtype)
+            labels[rows] = result
+
+        if 'post' in stage and labels is not None:
+            labels = np.asarray(stage['post'](labels))
+
+    return labels
@@ -5,12 +5,15 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.externals import joblib
 from sklearn.metrics import confusion_matrix
 from sklearn.neural_network import MLPClassifier
-from scipy.stats import multivariate_normal
-from collections import Counter
+from scipy.linalg import solve_triangular
 import numpy as np
-import pickle
 import argparse
 import profiling
+import profiled_store
+import model_registry
+import live_inference
+import smoothing
+import cascade
 
 
 def get_centroids(traffic_classes, obs_classes, features):
@@ -25,82 +28,108 @@ def get_covariances(traffic_classes, obs_classes, features):
     return centroids
 
 
-def distance(centroid, point):
-    return np.sqrt(np.sum(np.square(point - centroid)))
+def squared_distances(points, centroids):
+    # Every (point, centroid) pair at once, |p|^2 - 2 p.c + |c|^2
+    return np.sum(np.square(points), axis=1)[:, np.newaxis] \
+        - 2 * points @ centroids.T + np.sum(np.square(centroids), axis=1)
 
 
 def classification_distances(centroids, test_features):
+    centroids = np.array([centroids[c] for c in centroids])
+    distances = squared_distances(np.asarray(test_features), centroids)
+
+    return dict(enumerate(np.argmin(distances, axis=1)))
+
+
+def gaussian_log_likelihoods(means, covs, test_features):
+    """Log density of each test row under each class' Gaussian.
+
+    Each covariance is Cholesky factorized once, the Mahalanobis distances
+    of all rows come from a single triangular solve per class.
+    """
     n_obs, n_features = test_features.shape
-    traffic_idx = {}
+    log_likelihoods = np.empty((n_obs, len(means)))
 
-    for i in range(n_obs):
-        w = test_features[i]
-        distances = [distance(w, centroids[c]) for c in centroids]
-        t_idx = np.argsort(distances)[0]
-        traffic_idx[i] = t_idx
+    for k, t in enumerate(means):
+        chol = np.linalg.cholesky(covs[t])
+        z = solve_triangular(chol, (test_features - means[t]).T, lower=True)
+        log_det = 2 * np.sum(np.log(np.diag(chol)))
+        log_likelihoods[:, k] = -0.5 * (n_features * np.log(2 * np.pi)
+                                        + log_det + np.sum(np.square(z), axis=0))
 
-    return traffic_idx
+    return log_likelihoods
 
 
 def classification_gaussian_distribution(traffic_classes, obs_classes, pca_features,
                                          test_pca_features):
-    n_obs, n_features = test_pca_features.shape
     means = get_centroids(traffic_classes, obs_classes, pca_features)
     covs = get_covariances(traffic_classes, obs_classes, pca_features)
-    traffic_idx = {}
+    log_likelihoods = gaussian_log_likelihoods(means, covs,
+                                               np.asarray(test_pca_features))
 
-    for i in range(n_obs):
-        w = test_pca_features[i, :]
-        probs = np.array([multivariate_normal.pdf(w, means[t], covs[t])
-                          for t in traffic_classes])
-        t_idx = np.argsort(probs)[-1]
-        traffic_idx[i] = t_idx
+    return dict(enumerate(np.argmax(log_likelihoods, axis=1)))
 
-    return traffic_idx
+
+def nearest_core_labels(dbscan, points, chunk_size=1024):
+    """DBSCAN cluster of each point, as the cluster of its nearest core sample.
+
+    Points farther than eps from every core sample are noise (-1).
+    """
+    core_samples = dbscan.components_
+    core_labels = dbscan.labels_[dbscan.core_sample_indices_]
+    labels = np.full(points.shape[0], -1)
+
+    if core_samples.shape[0] == 0:
+        return labels
+
+    for start in range(0, points.shape[0], chunk_size):
+        distances = squared_distances(points[start:start+chunk_size],
+                                      core_samples)
+        nearest = np.argmin(distances, axis=1)
+        near = distances[np.arange(len(nearest)), nearest] <= dbscan.eps ** 2
+        labels[start:start+chunk_size][near] = core_labels[nearest[near]]
+
+    return labels
 
 
 def classification_clustering(traffic_classes, obs_classes, norm_pca_features,
                               norm_pca_test_features, n_clusters=3, eps=10000,
                               method=0):
-    traffic_idx = {}
-    n_obs, n_features = norm_pca_features.shape
-    centroids = np.array([])
+    norm_pca_features = np.asarray(norm_pca_features)
+    norm_pca_test_features = np.asarray(norm_pca_test_features)
+    obs_classes = obs_classes.flatten().astype(int)
+    n_classes = max(traffic_classes) + 1
 
-    for c in range(n_clusters):
-        centroids = np.append(centroids, np.mean(
-            norm_pca_features[(obs_classes == c).flatten(), :], axis=0))
-
-    centroids = centroids.reshape((n_clusters, n_features))
+    centroids = np.array([
+        np.mean(norm_pca_features[obs_classes == c, :], axis=0)
+        for c in range(n_clusters)])
 
     cluster_method = KMeans(init=centroids, n_clusters=n_clusters) \
         if method == 0 else DBSCAN(eps=eps)
     cluster_method.fit(norm_pca_features)
     labels = cluster_method.labels_
 
-    # Determines and quantifies the presence of each original class observation
-    #  in each cluster
-    clusters = np.zeros((n_clusters, n_features))
-    for cluster in range(n_clusters):
-        aux = obs_classes[(labels == cluster)]
-        for c in range(n_features):
-            clusters[cluster, c] = np.sum(aux == c)
-
-    cluster_probs = clusters / np.sum(clusters, axis=1)[:, np.newaxis]
+    if method == 0:
+        test_labels = cluster_method.predict(norm_pca_test_features)
+    else:
+        test_labels = nearest_core_labels(cluster_method,
+                                          norm_pca_test_features)
 
-    for i in range(norm_pca_test_features.shape[0]):
-        x = norm_pca_test_features[i, :].reshape((1, n_features))
-        label = cluster_method.predict(x)
-        t_probs = 100 * cluster_probs[label, :].flatten()
-        t_idx = np.argsort(t_probs)[-1]
-        traffic_idx[i] = t_idx
+    # DBSCAN noise (-1) is profiled as one more cluster, after the others
+    n_rows = labels.max() + 2
+    labels = np.where(labels < 0, n_rows - 1, labels)
+    test_labels = np.where(test_labels < 0, n_rows - 1, test_labels)
 
-    return traffic_idx
+    # Determines and quantifies the presence of each original class observation
+    #  in each cluster
+    clusters = np.bincount(labels * n_classes + obs_classes,
+                           minlength=n_rows * n_classes) \
+        .reshape((n_rows, n_classes))
 
+    return dict(enumerate(np.argmax(clusters[test_labels], axis=1)))
 
-def classification_random_forests(new_model, obs_classes, norm_features, 
-                                  norm_test_features, max_depth=2):
-    traffic_idx = {}
 
+def random_forest_model(new_model, obs_classes, norm_features, max_depth=2):
     if new_model:
         # Save model
         clf = RandomForestClassifier(max_depth, random_state=0)
@@ -110,12 +139,15 @@ def classification_random_forests(new_model, obs_classes, norm_features,
         # Load model
         clf = joblib.load('classification-model/classification_model_rf.sav')
 
-    result = clf.predict(norm_test_features)
+    return clf
 
-    for i in range(norm_test_features.shape[0]):
-        traffic_idx[i] = result[i]
 
-    return traffic_idx
+def classification_random_forests(new_model, obs_classes, norm_features, 
+                                  norm_test_features, max_depth=2):
+    clf = random_forest_model(new_model, obs_classes, norm_features, max_depth)
+    result = clf.predict(norm_test_features)
+
+    return dict(enumerate(result))
 
 
 def classification_svm(new_model, obs_classes, norm_features,
@@ -147,18 +179,14 @@ def classification_svm(new_model, obs_classes, norm_features,
     return traffic_idx
 
 
-def classification_silence(norm_test_features):
-    traffic_idx = {}
-
-    # Load model
-    clf = joblib.load('classification-model/classification_model_svm_silence.sav')
+def silence_model():
+    return model_registry.get('classification_model_svm_silence.sav')
 
-    result = clf.predict(norm_test_features)
 
-    for i in range(norm_test_features.shape[0]):
-        traffic_idx[i] = result[i]
+def classification_silence(norm_test_features):
+    result = silence_model().predict(norm_test_features)
 
-    return traffic_idx
+    return dict(enumerate(result))
 
 
 def classification_neural_networks(new_model, obs_classes, norm_pca_features,
@@ -189,34 +217,11 @@ def classification_neural_networks(new_model, obs_classes, norm_pca_features,
     return traffic_idx
 
 
-def classify_aggregation_window(window, threshold=0.55):
-    num_class = {k: v for k,v in Counter(window).items()}
-    max_repetition = max(num_class, key=num_class.get)
-
-    if num_class[max_repetition] / len(window) > threshold:
-        return [max_repetition for i in range(len(window))]
-
-    return window
-
-
 def improve_classification_history(traffic_samples, traffic_idx, window_size=40, 
                                    threshold=0.60):
-    traffic_idx = list(traffic_idx.values())
-
     # Use historic view to classify windows
-    for ts in traffic_samples:
-        i = 0
-        while i + window_size < ts:
-            c = classify_aggregation_window(traffic_idx[i:i+window_size], 
-                                            threshold)
-            traffic_idx[i:i+window_size] = c
-            i += window_size
-
-        if ts - i > 0:
-            c = classify_aggregation_window(traffic_idx[i:ts], threshold)
-            traffic_idx[i:ts] = c
-
-    return traffic_idx
+    return smoothing.smooth_history(traffic_samples, list(traffic_idx.values()),
+                                    window_size, threshold)
 
 
 def binary_scores(conf_matrix, change_class, max_class):
@@ -232,15 +237,7 @@ def binary_scores(conf_matrix, change_class, max_class):
 
 
 def classify_live_data(norm_pca_features):
-    model = joblib.load('classification-model/classification_model.sav')
-    result = model.predict(norm_pca_features)
-
-    not_mining = len([r for r in result if r < 7])
-    classes = {
-        'nmin': not_mining / len(result),
-        'min': (len(result) - not_mining) / len(result)
-    }
-    return classes
+    return live_inference.classify_live_data(norm_pca_features)
 
 
 def print_cm(cm, labels, hide_zeroes=False, hide_diagonal=False, hide_threshold=None):
@@ -288,35 +285,37 @@ def main():
     parser.add_argument('-c', '--classification', action='store_true', 
             default=False, help='generate new classification model (default:false)')
     parser.add_argument('-m', '--method', nargs='?', default=0, type=int,
-            help='classification method - 0:Multimethod | 1:SVM | 2: NN (default: 0)')
+            help='classification method - 0:Multimethod | 1:SVM | 2: NN | '
+                 '3: Distances | 4: Gaussian | 5: K-Means | 6: DBSCAN '
+                 '(default: 0)')
+    parser.add_argument('-n', '--nocache', action='store_true', default=False,
+            help='do not use the profiling feature cache (default: false)')
+    parser.add_argument('-j', '--jobs', nargs='?', type=int,
+            help='profiling worker processes (default: one per core)')
+    parser.add_argument('-o', '--outofcore', action='store_true', default=False,
+            help='profile and fit the scaler and PCA out of core (default: false)')
     args = parser.parse_args()
 
-    if args.profiling:
+    if args.profile:
         # Generate new profiled data
         unnorm_train_features, unnorm_test_features, \
         norm_pca_train_features, norm_pca_test_features, \
-        traffic_classes, traffic_samples_number = profiling.profiling()
+        traffic_classes, traffic_samples_number = \
+            profiling.profiling(not args.nocache, args.jobs, args.outofcore)
 
         # Save profiling data
-        d = {
+        profiled_store.save_store({
             'unnorm_train': unnorm_train_features,
             'unnorm_test': unnorm_test_features,
             'norm_train': norm_pca_train_features,
             'norm_test': norm_pca_test_features,
-            'classes': traffic_classes,
-            'samples_number': traffic_samples_number
-        }
-
-        with open('profiled-data/input_data.pkl', 'wb') as output:
-            pickle.dump(d, output, pickle.HIGHEST_PROTOCOL)
+        }, traffic_classes, traffic_samples_number)
 
     else:
-        # Load saved profiled data
-        with open('profiled-data/input_data.pkl', 'rb') as input:
-            d = pickle.load(input)
+        # Load saved profiled data, only the blocks used below are mapped
+        d = profiled_store.load_profiled_data(
+            blocks=('norm_train', 'norm_test'))
 
-        unnorm_train_features = d['unnorm_train']
-        unnorm_test_features = d['unnorm_test']
         norm_pca_train_features = d['norm_train']
         norm_pca_test_features = d['norm_test']
         traffic_classes = d['classes']
@@ -329,23 +328,25 @@ def main():
     #profiling.plot_features(unnorm_train_features, traffic_classes)
 
     if args.method == 0:
-        # Classify using two models
-        # First default model
-        y_test_model1 = classification_random_forests(
-                args.classification, obs_classes, norm_pca_train_features,
-                norm_pca_test_features, max_depth=2)
-
-        # Perform window aggregation
-        y_test_model1 = improve_classification_history(
-                traffic_samples_number, y_test_model1)
-
-        possible_mining = [i for i, x in enumerate(y_test_model1) if x >= 13]
-
-        # Silence model
-        y_test_model2 = classification_silence(norm_pca_test_features[:, 24:32])
-
-        y_test = [y_test_model2[i] if i in possible_mining else y_test_model1[i]
-                  for i in range(len(y_test_model1))]
+        # Classify using two models: the default model on every window, with
+        # window aggregation, then the silence model only on the windows it
+        # classified as possible mining
+        stages = [
+            {
+                'model': random_forest_model(
+                    args.classification, obs_classes, norm_pca_train_features,
+                    max_depth=2),
+                'columns': slice(None),
+                'post': lambda labels: smoothing.smooth_history(
+                    traffic_samples_number, labels),
+            },
+            {
+                'model': silence_model(),
+                'columns': slice(24, 32),
+                'route': lambda labels: labels >= 13,
+            },
+        ]
+        y_test = cascade.run_cascade(stages, norm_pca_test_features)
 
     elif args.method == 1:
         # Classify using SVM
@@ -361,6 +362,28 @@ def main():
                 norm_pca_train_features, norm_pca_test_features)
         y_test = improve_classification_history(traffic_samples_number, y_test)
 
+    elif args.method == 3:
+        # Classify by the nearest class centroid
+        centroids = get_centroids(traffic_classes, obs_classes,
+                                  norm_pca_train_features)
+        y_test = classification_distances(centroids, norm_pca_test_features)
+        y_test = improve_classification_history(traffic_samples_number, y_test)
+
+    elif args.method == 4:
+        # Classify by the most likely class Gaussian
+        y_test = classification_gaussian_distribution(
+                traffic_classes, obs_classes,
+                norm_pca_train_features, norm_pca_test_features)
+        y_test = improve_classification_history(traffic_samples_number, y_test)
+
+    elif args.method in (5, 6):
+        # Classify by the most common class of each window's cluster
+        y_test = classification_clustering(
+                traffic_classes, obs_classes,
+                norm_pca_train_features, norm_pca_test_features,
+                n_clusters=len(traffic_classes), method=args.method - 5)
+        y_test = improve_classification_history(traffic_samples_number, y_test)
+
     cm = confusion_matrix(obs_classes, y_test)
     print_results(cm, 13, 31)
 
@@ -0,0 +1,250 @@
+import os
+import argparse
+import numpy as np
+
+# Rows of random features the exported predictions are checked on
+CHECK_ROWS = 1000
+
+
+def export_forest(clf):
+    """Flattens the trees of a random forest into one set of node arrays.
+
+    Child indices are global (offset by the tree's first node), right child
+    first, and leaves are their own children so every tree is walked in
+    max_depth steps. Leaves hold their class probabilities.
+    """
+    children, feature, threshold, proba, roots = [], [], [], [], []
+    offset = 0
+
+    for estimator in clf.estimators_:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count) + offset
+        is_leaf = tree.children_left < 0
+        roots.append(offset)
+        children.append(np.column_stack((
+            np.where(is_leaf, nodes, tree.children_right + offset),
+            np.where(is_leaf, nodes, tree.children_left + offset))))
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        value = tree.value[:, 0, :]
+        proba.append(value / value.sum(axis=1, keepdims=True))
+        offset += tree.node_count
+
+    return {
+        'kind': np.array('forest'),
+        'classes': clf.classes_,
+        'n_features': np.array(clf.estimators_[0].tree_.n_features),
+        'max_depth': np.array(max(e.tree_.max_depth for e in clf.estimators_)),
+        'roots': np.array(roots, dtype=np.int32),
+        'children': np.concatenate(children).astype(np.int32),
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold),
+        'proba': np.concatenate(proba),
+    }
+
+
+def export_svm(clf):
+    if getattr(clf, 'kernel', 'linear') != 'linear':
+        raise ValueError('Only linear SVMs can be exported, not {} kernels'
+                         .format(clf.kernel))
+
+    # SVC is one-vs-one (one row per pair of classes), LinearSVC one-vs-rest
+    kind = 'svc' if hasattr(clf, 'support_vectors_') else 'linear_svc'
+
+    return {
+        'kind': np.array(kind),
+        'classes': clf.classes_,
+        'n_features': np.array(clf.coef_.shape[1]),
+        'coef': np.asarray(clf.coef_),
+        'intercept': np.asarray(clf.intercept_),
+    }
+
+
+def export_mlp(clf):
+    arrays = {
+        'kind': np.array('mlp'),
+        'classes': clf.classes_,
+        'n_features': np.array(clf.coefs_[0].shape[0]),
+        'activation': np.array(clf.activation),
+        'n_layers': np.array(len(clf.coefs_)),
+    }
+    for i, (w, b) in enumerate(zip(clf.coefs_, clf.intercepts_)):
+        arrays['weights_{}'.format(i)] = w
+        arrays['bias_{}'.format(i)] = b
+
+    return arrays
+
+
+def export_model(clf):
+    if hasattr(clf, 'estimators_'):
+        return export_forest(clf)
+    if hasattr(clf, 'coefs_'):
+        return export_mlp(clf)
+    if hasattr(clf, 'coef_') or hasattr(clf, 'support_vectors_'):
+        return export_svm(clf)
+    raise ValueError('Cannot export {} models'.format(type(clf).__name__))
+
+
+def export_projection(scaler, pca):
+    """Fuses a StandardScaler and a PCA into one affine projection.
+
+    pca.transform(scaler.transform(x)) == x @ weights + bias
+    """
+    return {
+        'weights': (pca.components_ / scaler.scale_).T,
+        'bias': -(scaler.mean_ / scaler.scale_ + pca.mean_) @ pca.components_.T,
+    }
+
+
+def predict_forest(model, x):
+    feature, threshold = model['feature'], model['threshold']
+    children = model['children']
+    # Compared in float32 as scikit-learn does, inputs within half a float32
+    # ulp of a threshold take the same branch. Flat index of each row's
+    # first feature
+    x_flat = np.ascontiguousarray(x, dtype=np.float32).ravel()
+    row_offsets = np.arange(x.shape[0]) * x.shape[1]
+
+    # One node per (tree, row), all trees go down one level at a time
+    nodes = np.repeat(model['roots'][:, None], x.shape[0], axis=1)
+    for depth in range(int(model['max_depth'])):
+        go_left = x_flat[row_offsets + feature[nodes]] <= threshold[nodes]
+        nodes = children[nodes, go_left.view(np.int8)]
+
+    proba = model['proba'][nodes].mean(axis=0)
+    return model['classes'][np.argmax(proba, axis=1)]
+
+
+def predict_svc(model, x):
+    classes = model['classes']
+    decision = x @ model['coef'].T + model['intercept']
+
+    if len(classes) == 2:
+        return classes[(decision[:, 0] > 0).astype(int)]
+
+    # One-vs-one voting, the pair (i, j) votes for i on a positive decision
+    votes = np.zeros((x.shape[0], len(classes)), dtype=int)
+    pair = 0
+    for i in range(len(classes)):
+        for j in range(i + 1, len(classes)):
+            positive = decision[:, pair] > 0
+            votes[:, i] += positive
+            votes[:, j] += ~positive
+            pair += 1
+
+    return classes[np.argmax(votes, axis=1)]
+
+
+def predict_linear_svc(model, x):
+    classes = model['classes']
+    decision = x @ model['coef'].T + model['intercept']
+
+    if len(classes) == 2:
+        return classes[(decision[:, 0] > 0).astype(int)]
+    return classes[np.argmax(decision, axis=1)]
+
+
+ACTIVATIONS = {
+    'identity': lambda z: z,
+    'relu': lambda z: np.maximum(z, 0),
+    'tanh': np.tanh,
+    'logistic': lambda z: 1 / (1 + np.exp(-z)),
+}
+
+
+def predict_mlp(model, x):
+    activation = ACTIVATIONS[str(model['activation'])]
+    n_layers = int(model['n_layers'])
+
+    for i in range(n_layers):
+        x = x @ model['weights_{}'.format(i)] + model['bias_{}'.format(i)]
+        if i < n_layers - 1:
+            x = activation(x)
+
+    # Softmax and logistic outputs keep the order of the last layer
+    classes = model['classes']
+    if len(classes) == 2:
+        return classes[(x[:, 0] > 0).astype(int)]
+    return classes[np.argmax(x, axis=1)]
+
+
+PREDICTORS = {
+    'forest': predict_forest,
+    'svc': predict_svc,
+    'linear_svc': predict_linear_svc,
+    'mlp': predict_mlp,
+}
+
+
+def predict(model, x):
+    """Predicts the classes of the rows of x with an exported model"""
+    x = np.asarray(x, dtype=np.float64).reshape((-1, int(model['n_features'])))
+    return PREDICTORS[str(model['kind'])](model, x)
+
+
+def save_model(path, arrays):
+    tmp_path = path[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_model(path):
+    with np.load(path) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+def compact_path(model_path):
+    return os.path.splitext(model_path)[0] + '.npz'
+
+
+def check_model(clf, model, n_rows=CHECK_ROWS):
+    # Random rows of the same order of magnitude of normalized features
+    x = np.random.RandomState(0).normal(
+        scale=3, size=(n_rows, int(model['n_features'])))
+    return np.array_equal(predict(model, x), clf.predict(x))
+
+
+def check_projection(projection, scaler, pca, x):
+    x = np.asarray(x)
+    return np.allclose(x @ projection['weights'] + projection['bias'],
+                       pca.transform(scaler.transform(x)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', nargs='+', required=True,
+            help='saved model(s) (.sav) to export')
+    parser.add_argument('-o', '--output', nargs='?',
+            help='output file for a single model (default: model name, .npz)')
+    args = parser.parse_args()
+
+    if args.output is not None and len(args.input) > 1:
+        print('ERROR: An output file can only be given for a single model!')
+        exit(1)
+
+    from sklearn.externals import joblib
+
+    for model_path in args.input:
+        if not os.path.exists(model_path):
+            print('ERROR: Invalid model file {}!'.format(model_path))
+            exit(1)
+
+        clf = joblib.load(model_path)
+        try:
+            model = export_model(clf)
+        except ValueError as e:
+            print('ERROR: {}!'.format(e))
+            exit(1)
+
+        if not check_model(clf, model):
+            print('ERROR: Exported {} predicts differently!'.format(model_path))
+            exit(1)
+
+        output_path = compact_path(model_path) if args.output is None \
+            else args.output
+        save_model(output_path, model)
+        print('{} -> {} ({})'.format(model_path, output_path, model['kind']))
+
+
+if __name__ == '__main__':
+    main()
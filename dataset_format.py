@@ -0,0 +1,151 @@
+import os
+import json
+import struct
+import argparse
+import numpy as np
+
+# Binary dataset layout (little endian):
+#   magic (8 bytes) | version (uint16) | number of columns (uint16) |
+#   header size (uint32) | number of samples (uint64) |
+#   sample interval in seconds (float64) | metadata size (uint32) |
+#   metadata (JSON) | padding up to header size | uint32 samples (row major)
+MAGIC = b'NYPTODS\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIQdI')
+HEADER_ALIGN = 64
+DTYPE = np.dtype('<u4')
+BINARY_EXTENSION = '.bdat'
+SAMPLE_DELTA = 0.5
+
+
+def binary_path(dataset_path):
+    return os.path.splitext(dataset_path)[0] + BINARY_EXTENSION
+
+
+def is_binary(dataset_path):
+    with open(dataset_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_dataset(dataset_path, data, sample_delta=SAMPLE_DELTA, metadata=None):
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape((-1, 1))
+    if data.size > 0 and (data.min() < 0 or data.max() > np.iinfo(DTYPE).max):
+        raise ValueError('Dataset values do not fit in {}'.format(DTYPE))
+
+    meta = json.dumps(metadata if metadata is not None else {}).encode('utf-8')
+    header_size = HEADER.size + len(meta)
+    header_size += -header_size % HEADER_ALIGN
+    n_samples, n_cols = data.shape
+
+    # Write next to the destination and rename so readers never map a
+    # partially written file
+    tmp_path = dataset_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, n_cols, header_size, n_samples,
+                            sample_delta, len(meta)))
+        f.write(meta)
+        f.write(b'\x00' * (header_size - HEADER.size - len(meta)))
+        f.write(np.ascontiguousarray(np.rint(data), dtype=DTYPE).tobytes())
+    os.replace(tmp_path, dataset_path)
+
+
+def read_header(dataset_path):
+    with open(dataset_path, 'rb') as f:
+        magic, version, n_cols, header_size, n_samples, sample_delta, \
+            meta_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a binary dataset'.format(dataset_path))
+        if version > VERSION:
+            raise ValueError('Unsupported dataset version {} in {}'.format(
+                version, dataset_path))
+        metadata = json.loads(f.read(meta_size).decode('utf-8'))
+
+    return {
+        'version': version,
+        'columns': n_cols,
+        'header_size': header_size,
+        'samples': n_samples,
+        'sample_delta': sample_delta,
+        'metadata': metadata,
+    }
+
+
+def load_binary_dataset(dataset_path, mmap=True):
+    header = read_header(dataset_path)
+    shape = (header['samples'], header['columns'])
+
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=DTYPE)
+
+    if mmap:
+        return np.memmap(dataset_path, dtype=DTYPE, mode='r',
+                         offset=header['header_size'], shape=shape)
+
+    with open(dataset_path, 'rb') as f:
+        f.seek(header['header_size'])
+        return np.fromfile(f, dtype=DTYPE, count=shape[0] * shape[1]) \
+            .reshape(shape)
+
+
+def load_dataset(dataset_path, mmap=True):
+    """Loads a dataset as a (samples x columns) array.
+
+    Binary datasets are memory mapped. For text datasets an up to date
+    binary copy next to them (same name, .bdat extension) is used instead
+    when it exists, otherwise the text file is parsed.
+    """
+    if is_binary(dataset_path):
+        return load_binary_dataset(dataset_path, mmap)
+
+    bin_path = binary_path(dataset_path)
+    if os.path.exists(bin_path) and \
+            os.path.getmtime(bin_path) >= os.path.getmtime(dataset_path):
+        return load_binary_dataset(bin_path, mmap)
+
+    return np.loadtxt(dataset_path, ndmin=2)
+
+
+def convert_dataset(dataset_path, output_path=None, sample_delta=SAMPLE_DELTA):
+    output_path = binary_path(dataset_path) if output_path is None \
+        else output_path
+    data = np.loadtxt(dataset_path, ndmin=2)
+    save_dataset(output_path, data, sample_delta,
+                 {'source': os.path.basename(dataset_path)})
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', nargs='+', required=True,
+            help='text dataset file(s) or directories')
+    parser.add_argument('-w', '--sampwindow', nargs='?', type=float,
+            default=SAMPLE_DELTA,
+            help='sampling interval (default {}s)'.format(SAMPLE_DELTA))
+    parser.add_argument('-f', '--force', action='store_true', default=False,
+            help='convert even if the binary dataset is up to date')
+    args = parser.parse_args()
+
+    dataset_paths = []
+    for p in args.input:
+        if os.path.isdir(p):
+            dataset_paths += [os.path.join(p, f) for f in sorted(os.listdir(p))
+                              if f.endswith('.dat')]
+        elif os.path.exists(p):
+            dataset_paths.append(p)
+        else:
+            print('ERROR: Invalid input file {}!'.format(p))
+            exit(1)
+
+    for d in dataset_paths:
+        bin_path = binary_path(d)
+        if not args.force and os.path.exists(bin_path) and \
+                os.path.getmtime(bin_path) >= os.path.getmtime(d):
+            continue
+        convert_dataset(d, bin_path, args.sampwindow)
+        print('{} -> {}'.format(d, bin_path))
+
+
+if __name__ == '__main__':
+    main()
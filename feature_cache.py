@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+CACHE_DIR = 'feature-cache'
+CACHE_MAX_SIZE = 1 << 30  # bytes
+CACHE_EXTENSION = '.npz'
+
+# Content hashes of already seen datasets, keyed by their files'
+# (path, size, mtime) and the offsets they were merged with
+_dataset_hashes = {}
+
+
+def dataset_hash(dataset_paths, data, offsets=None):
+    """Content hash of a dataset loaded (or merged with offsets) from the
+    given files"""
+    stamp = []
+    for p in dataset_paths:
+        st = os.stat(p)
+        stamp.append((os.path.abspath(p), st.st_size, st.st_mtime_ns))
+    stamp = (tuple(stamp), None if offsets is None else tuple(offsets))
+
+    if stamp not in _dataset_hashes:
+        # Hash the samples rather than the file, text and binary copies of
+        # the same dataset share their entries
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        h = hashlib.sha256(str(data.shape).encode('utf-8'))
+        h.update(data.tobytes())
+        _dataset_hashes[stamp] = h.hexdigest()
+
+    return _dataset_hashes[stamp]
+
+
+def cache_key(content_hashes, **params):
+    key = json.dumps({'datasets': content_hashes, 'params': params},
+                     sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def entry_path(key, cache_dir=None):
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    return os.path.join(cache_dir, key + CACHE_EXTENSION)
+
+
+def load(key, cache_dir=None):
+    path = entry_path(key, cache_dir)
+
+    try:
+        with np.load(path) as entry:
+            arrays = {name: entry[name] for name in entry.files}
+    except (OSError, ValueError, KeyError):
+        # Missing, evicted meanwhile or corrupted
+        return None
+
+    # Mark as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return arrays
+
+
+def store(key, arrays, cache_dir=None, max_size=None):
+    path = entry_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.tmp{}'.format(path[:-len(CACHE_EXTENSION)], os.getpid(),
+                                    CACHE_EXTENSION)
+
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    evict(os.path.dirname(path), max_size)
+
+
+def evict(cache_dir=None, max_size=None):
+    """Removes the least recently used entries until the cache fits max_size"""
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    max_size = CACHE_MAX_SIZE if max_size is None else max_size
+    entries = []
+
+    for name in os.listdir(cache_dir):
+        if not name.endswith(CACHE_EXTENSION) or '.tmp' in name:
+            continue
+        try:
+            st = os.stat(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+
+    total = sum(e[1] for e in entries)
+    for mtime, size, name in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+        total -= size
+
+
+def clear(cache_dir=None):
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if os.path.isdir(cache_dir):
+        evict(cache_dir, 0)
@@ -4,8 +4,9 @@ import argparse
 import pyshark
 import numpy as np
 from netaddr import IPNetwork, IPAddress, IPSet
-from profiling import extract_live_features, normalize_live_features
-from classification import classify_live_data
+from live_inference import extract_live_features, normalize_live_features, \
+    classify_live_data
+from streaming_features import SlidingWindowFeatures, combine_windows
 
 N_PACKETS = 0
 OUTFILE_PATH = 'samples/'
@@ -20,6 +21,7 @@ N_FEATURES = 5
 TRAFFIC_STATS = None
 LOCAL_IPS = {}
 TCP_PORTS = {}
+FLOW_FEATURES = {}
 BASE_TIMESTAMP = None
 MINING_THRESHOLD = 0.7
 
@@ -60,7 +62,21 @@ def add_new_tcp_port():
     TRAFFIC_STATS = new_stats
 
 
-def classify(local_ip, remote_port):
+def new_flow_features():
+    # [feature engine, samples pushed into it, features of finished windows]
+    return [SlidingWindowFeatures(N_FEATURES - 1, scales=[2, 4]), 0, []]
+
+
+def update_flow_features(flow, info, n_samples):
+    # Samples before n_samples are final, features are computed slide by
+    # slide while the flow fills its window
+    engine, n_pushed, results = flow
+    if n_samples > n_pushed:
+        results.append(engine.push(info[n_pushed:n_samples, 1:]))
+        flow[1] = n_samples
+
+
+def classify(local_ip, remote_port, features=None):
     global TRAFFIC_STATS
     global MINING_THRESHOLD
 
@@ -68,8 +84,11 @@ def classify(local_ip, remote_port):
     port_idx = TCP_PORTS[remote_port]
 
     # Traffic profiling
-    dataset = TRAFFIC_STATS[src_idx][port_idx][:, 1:]
-    f, fs, fw = extract_live_features(dataset)
+    if features is None:
+        dataset = TRAFFIC_STATS[src_idx][port_idx][:, 1:]
+        f, fs, fw = extract_live_features(dataset)
+    else:
+        f, fs, fw = features
     all_features = np.hstack((f, fs, fw))
 
     # Less than 3 valid windows, cannot extract features with PCA
@@ -103,6 +122,7 @@ def pkt_callback(pkt):
     global LOCAL_IPS
     global TCP_PORTS
     global BASE_TIMESTAMP
+    global FLOW_FEATURES
 
     if 'ipv6' in [l.layer_name for l in pkt.layers]:
         src_ip = IPAddress(pkt.ipv6.src)
@@ -155,12 +175,25 @@ def pkt_callback(pkt):
     time_delta = timestamp - info[0][0] if info[0][0] != -1 else timestamp
     idx = 0 if time_delta == 0 else int(time_delta / SAMPLE_DELTA)
 
+    if (src_idx, port_idx) not in FLOW_FEATURES:
+        FLOW_FEATURES[(src_idx, port_idx)] = new_flow_features()
+    flow = FLOW_FEATURES[(src_idx, port_idx)]
+
     if idx >= WINDOW_DELTA:
-        rtn = classify(local_ip, remote_port)
+        # Same windows extract_live_features takes from the full buffer
+        update_flow_features(flow, info, WINDOW_DELTA)
+        n_obs_windows = int((WINDOW_DELTA - flow[0].obs_window) /
+                            flow[0].slide_window)
+        features = combine_windows(flow[2], n_obs_windows)[1:]
+
+        rtn = classify(local_ip, remote_port, features)
+        FLOW_FEATURES[(src_idx, port_idx)] = flow = new_flow_features()
         TRAFFIC_STATS[src_idx][port_idx] = np.zeros((WINDOW_DELTA, N_FEATURES))
         TRAFFIC_STATS[src_idx][port_idx][0][0] = rtn
         idx = 0
         info[idx][0] = timestamp
+    else:
+        update_flow_features(flow, info, idx)
 
     info[idx][1+up_down] += size
     info[idx][3+up_down] += 1
@@ -1,15 +1,52 @@
 import os
 import argparse
 import numpy as np
-from functools import reduce
+import dataset_format
 
+CHUNK_SIZE = 65536
 
-def parse_packets(cap_files, output_path):
-    metrics = [np.loadtxt(f) for f in cap_files]
-    min_dim = min([m.shape[0] for m in metrics])
-    sum_func = lambda a, b: a + b
-    metrics = reduce(sum_func, [m[:min_dim] for m in metrics])
-    np.savetxt(output_path, metrics)
+
+def merged_length(metrics, offsets):
+    return min([o + m.shape[0] for m, o in zip(metrics, offsets)])
+
+
+def iter_merged(cap_files, offsets=None, chunk_size=CHUNK_SIZE):
+    """Yields the elementwise sum of the given datasets, chunk by chunk.
+
+    Each dataset can be delayed by a number of samples (offsets), the merge
+    is truncated to the shortest delayed dataset.
+    """
+    metrics = [dataset_format.load_dataset(f) for f in cap_files]
+    offsets = [0] * len(metrics) if offsets is None else list(offsets)
+    n_samples = merged_length(metrics, offsets)
+    n_cols = metrics[0].shape[1]
+
+    for start in range(0, n_samples, chunk_size):
+        end = min(start + chunk_size, n_samples)
+        chunk = np.zeros((end - start, n_cols))
+        for m, o in zip(metrics, offsets):
+            lo, hi = max(start - o, 0), end - o
+            if hi > lo:
+                chunk[lo + o - start:] += m[lo:hi]
+        yield chunk
+
+
+def merge_datasets(cap_files, offsets=None, chunk_size=CHUNK_SIZE):
+    return np.concatenate(list(iter_merged(cap_files, offsets, chunk_size))) \
+        if len(cap_files) > 0 else np.zeros((0, 0))
+
+
+def parse_packets(cap_files, output_path, offsets=None):
+    if output_path.endswith(dataset_format.BINARY_EXTENSION):
+        dataset_format.save_dataset(
+            output_path, merge_datasets(cap_files, offsets), metadata={
+                'source': [os.path.basename(f) for f in cap_files],
+                'offsets': offsets})
+        return
+
+    with open(output_path, 'wb') as f:
+        for chunk in iter_merged(cap_files, offsets):
+            np.savetxt(f, chunk)
 
 
 def main():
@@ -18,6 +55,8 @@ def main():
                         required=True, help='input capture file(s)')
     parser.add_argument('-o', '--output', nargs='?',
                         required=True, help='output processed file')
+    parser.add_argument('-t', '--offsets', nargs='+', type=int,
+                        help='samples each input is delayed by (default: 0)')
     args = parser.parse_args()
 
     for f in args.input:
@@ -25,13 +64,17 @@ def main():
             print("ERROR: Invalid input file!")
             exit(1)
 
+    if args.offsets is not None and len(args.offsets) != len(args.input):
+        print("ERROR: One offset is needed per input file!")
+        exit(1)
+
     if os.path.exists(args.output):
         if input('Write over file? [y/N] ') == 'y':
             os.remove(args.output)
         else:
             exit()
 
-    parse_packets(args.input, args.output)
+    parse_packets(args.input, args.output, args.offsets)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import model_registry
+import compact_models
+import window_features
+
+# Live models, the compact (.npz) exports are used unless older than the models
+# they were exported from
+PROJECTION_MODEL = 'projection.npz'
+SCALER_MODEL = 'scaler.sav'
+PCA_MODEL = 'pca_model.sav'
+CLASSIFICATION_MODEL = 'classification_model.sav'
+# Classes below this index are not mining
+MINING_CLASS_START = 7
+
+
+def extract_live_features(data, obs_window=840, slide_window=40,
+                          scales=(2, 4)):
+    """Statistical, silence and wavelet features of the windows of a flow.
+
+    A flow not longer than an observation window is a single window. The
+    whole flow is extracted at once by the batch kernels, flows fed sample
+    by sample keep a streaming_features engine instead.
+    """
+    windows = window_features.break_train_test(
+        np.asarray(data, dtype=np.float64), obs_window, slide_window,
+        train_percentage=0.0, random_split=False)[1]
+    empty_windows, features = window_features.extract_features(windows)
+
+    return features, \
+        window_features.extract_features_silence(windows, empty_windows), \
+        window_features.extract_features_wavelet(windows, empty_windows,
+                                                 list(scales))
+
+
+def model_exists(name):
+    return os.path.exists(os.path.join(model_registry.MODEL_DIR, name))
+
+
+def model_current(name, sources):
+    """Whether model name exists and is not older than any of its sources"""
+    path = os.path.join(model_registry.MODEL_DIR, name)
+    if not os.path.exists(path):
+        return False
+
+    mtime = os.stat(path).st_mtime_ns
+    for source in sources:
+        source_path = os.path.join(model_registry.MODEL_DIR, source)
+        if os.path.exists(source_path) and \
+                os.stat(source_path).st_mtime_ns > mtime:
+            return False
+    return True
+
+
+def normalize_live_features(features):
+    if model_current(PROJECTION_MODEL, (SCALER_MODEL, PCA_MODEL)):
+        projection = model_registry.get(PROJECTION_MODEL)
+        return np.asarray(features) @ projection['weights'] \
+            + projection['bias']
+
+    scaler = model_registry.get(SCALER_MODEL)
+    pca = model_registry.get(PCA_MODEL)
+    return pca.transform(scaler.transform(features))
+
+
+def predict(model_name, features):
+    compact_name = compact_models.compact_path(model_name)
+    if model_current(compact_name, (model_name,)):
+        return compact_models.predict(model_registry.get(compact_name),
+                                      features)
+
+    return model_registry.get(model_name).predict(features)
+
+
+def classify_live_data(norm_pca_features):
+    result = predict(CLASSIFICATION_MODEL, norm_pca_features)
+
+    not_mining = int(np.count_nonzero(np.asarray(result) < MINING_CLASS_START))
+    classes = {
+        'nmin': not_mining / len(result),
+        'min': (len(result) - not_mining) / len(result)
+    }
+    return classes
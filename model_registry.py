@@ -0,0 +1,61 @@
+import os
+import threading
+import numpy as np
+
+MODEL_DIR = 'classification-model'
+
+# Loaded artifacts keyed by path, as (file stamp, artifact) pairs
+_artifacts = {}
+_lock = threading.Lock()
+
+
+def file_stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def load_artifact(path):
+    # NumPy archives (.npz) load as dicts of arrays, everything else with
+    # joblib
+    if path.endswith('.npz'):
+        with np.load(path) as archive:
+            return {name: archive[name] for name in archive.files}
+
+    from sklearn.externals import joblib
+    return joblib.load(path)
+
+
+def get(name, model_dir=None):
+    """Returns the artifact model_dir/name, shared by every caller.
+
+    It is loaded on first use and loaded again whenever the file changes
+    (modification time or size). While a new version cannot be loaded, e.g.
+    because it is still being written, the previous one is returned.
+    """
+    path = os.path.join(MODEL_DIR if model_dir is None else model_dir, name)
+    stamp = file_stamp(path)
+    entry = _artifacts.get(path)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+
+    with _lock:
+        entry = _artifacts.get(path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+        try:
+            artifact = load_artifact(path)
+        except Exception:
+            if entry is None:
+                raise
+            return entry[1]
+
+        # Readers see either the old or the new pair, never a mix
+        _artifacts[path] = (stamp, artifact)
+
+    return artifact
+
+
+def clear():
+    with _lock:
+        _artifacts.clear()
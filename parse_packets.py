@@ -1,6 +1,12 @@
 import os
-import pyshark
+import bisect
+import socket
 import argparse
+import numpy as np
+from array import array
+from netaddr import IPNetwork, IPAddress, IPSet
+from pcap_reader import read_tcp_packets
+import dataset_format
 
 INFILE_PATH = 'miner.pcapng'
 OUTFILE_PATH = 'datasets/mining_4t_nicehash.dat'
@@ -9,84 +15,240 @@ SAMPLE_DELTA = 0.5
 LOCAL_IP = '192.168.1.158'
 LOCAL_IPV6 = '2001:8a0:de41:5501:9af7:5d3d:ed53:73dd'
 REMOTE_PORTS = [3341, 3333, 3334, 3357, 80, 443]
+BACKEND = 'native'
+CLIENT_NETS_SET = None
+ALL_PORTS = False
 
 
-def save_to_file(delta, last_bytes_up, last_bytes_down,
-        last_npkts_up, last_npkts_down):
+def save_to_file(bins, outfile_path=None):
     global OUTFILE_PATH
 
-    with open(OUTFILE_PATH, "a") as f:
-        f.write("{} {} {} {}\n".format(last_bytes_up, last_bytes_down,
-            last_npkts_up, last_npkts_down))
+    outfile_path = OUTFILE_PATH if outfile_path is None else outfile_path
+    n_rows, n_cols = bins.shape
 
-        diff_intervals = int(delta / SAMPLE_DELTA) - 1
+    if outfile_path.endswith(dataset_format.BINARY_EXTENSION):
+        dataset_format.save_dataset(outfile_path, bins, SAMPLE_DELTA,
+                                    {'source': os.path.basename(INFILE_PATH)})
+        return
 
-        for i in range(diff_intervals):
-            f.write("0 0 0 0\n")
+    # Format the whole series at once and write it in a single call
+    with open(outfile_path, "w") as f:
+        f.write((" ".join(["%d"] * n_cols) + "\n") * n_rows
+                % tuple(bins.ravel().tolist()))
 
 
-def process_packets(tcp_cap):
-    global SAMPLE_DELTA
+def pyshark_tcp_packets(path):
+    # tshark fallback, much slower but able to read anything Wireshark reads
+    import pyshark
 
-    last_timestamp = None
-    last_bytes_up = 0
-    last_bytes_down = 0
-    last_npkts_up = 0
-    last_npkts_down = 0
+    tcp_cap = pyshark.FileCapture(path, display_filter='tcp', keep_packets=False)
 
     for packet in tcp_cap:
-        packet_type = -1
         if 'ipv6' in [l.layer_name for l in packet.layers]:
-            ip = LOCAL_IPV6
+            family = socket.AF_INET6
             src = packet.ipv6.src
             dst = packet.ipv6.dst
             size = int(packet.ipv6.plen)
         else:
-            ip = LOCAL_IP
+            family = socket.AF_INET
             src = packet.ip.src
             dst = packet.ip.dst
             size = int(packet.ip.get_field('Len'))
 
-        if src == ip and int(packet.tcp.get_field('DstPort')) in REMOTE_PORTS:
-            packet_type = 0
-        elif int(packet.tcp.get_field('SrcPort')) in REMOTE_PORTS and dst == ip:
-            packet_type = 1
-
-        if packet_type == 0:
-            if last_timestamp is None:
-                last_timestamp = float(packet.sniff_timestamp)
-                last_bytes_down += size
-                last_npkts_down += 1
-            else:
-                time_delta = float(packet.sniff_timestamp) - last_timestamp
-                if time_delta > SAMPLE_DELTA:
-                    save_to_file(time_delta, last_bytes_up, last_bytes_down,
-                            last_npkts_up, last_npkts_down)
-                    last_timestamp = float(packet.sniff_timestamp)
-                    last_bytes_down = size
-                    last_npkts_down = 1
-                else:
-                    last_bytes_down += size
-                    last_npkts_down += 1
-        elif packet_type == 1:
-            if last_timestamp is None:
-                last_timestamp = float(packet.sniff_timestamp)
-                last_bytes_up += size
-                last_npkts_up += 1
-            else:
-                time_delta = float(packet.sniff_timestamp) - last_timestamp
-                if time_delta > SAMPLE_DELTA:
-                    save_to_file(time_delta, last_bytes_up, last_bytes_down,
-                            last_npkts_up, last_npkts_down)
-                    last_timestamp = float(packet.sniff_timestamp)
-                    last_bytes_up = size
-                    last_npkts_up = 1
-                else:
-                    last_bytes_up += size
-                    last_npkts_up += 1
-
-    save_to_file(0, last_bytes_up, last_bytes_down, last_npkts_up,
-            last_npkts_down)
+        yield float(packet.sniff_timestamp), \
+            socket.inet_pton(family, src), socket.inet_pton(family, dst), \
+            int(packet.tcp.get_field('SrcPort')), \
+            int(packet.tcp.get_field('DstPort')), size
+
+
+def read_packets(path, backend='native'):
+    if backend == 'pyshark':
+        return pyshark_tcp_packets(path)
+    return read_tcp_packets(path)
+
+
+def bin_packets(timestamps, directions, sizes, sample_delta=None):
+    """Aggregates packets into sampling intervals.
+
+    Direction 0 is traffic sent by the local host and 1 traffic received by
+    it. Returns an (n_samples, 4) array with the received bytes, sent bytes,
+    received packets and sent packets of each interval, exactly as the old
+    per-packet loop wrote them. An interval starts with the first packet
+    arriving more than sample_delta seconds after the start of the previous
+    one, empty intervals are filled with zeros.
+    """
+    global SAMPLE_DELTA
+
+    sample_delta = SAMPLE_DELTA if sample_delta is None else sample_delta
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    n_packets = len(timestamps)
+
+    if n_packets == 0:
+        return np.zeros((1, 4), dtype=np.int64)
+
+    order = np.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order]
+    directions = np.asarray(directions)[order]
+    sizes = np.asarray(sizes)[order]
+
+    # Interval boundaries depend on the previous interval start, so they are
+    # found by bisection (one step per interval instead of per packet)
+    ts = timestamps.tolist()
+    starts = []
+    i = 0
+    while i < n_packets:
+        starts.append(i)
+        start = ts[i]
+        j = bisect.bisect_right(ts, start + sample_delta, i + 1)
+        while j < n_packets and ts[j] - start <= sample_delta:
+            j += 1
+        while j > i + 1 and ts[j - 1] - start > sample_delta:
+            j -= 1
+        i = j
+    starts = np.array(starts)
+
+    n_intervals = len(starts)
+    interval = np.zeros(n_packets, dtype=np.int64)
+    interval[starts[1:]] = 1
+    interval = np.cumsum(interval)
+
+    # Received traffic goes to columns 0 and 2, sent traffic to 1 and 3
+    bytes_idx = interval * 4 + 1 - directions
+    npkts_idx = interval * 4 + 3 - directions
+    counts = np.bincount(bytes_idx, weights=sizes, minlength=n_intervals * 4) + \
+        np.bincount(npkts_idx, minlength=n_intervals * 4)
+    counts = counts.astype(np.int64).reshape((n_intervals, 4))
+
+    # The counters of one direction are only reset by an interval started by
+    # a packet of that direction, otherwise they keep accumulating
+    start_dir = directions[starts]
+    for d in (0, 1):
+        cols = [1 - d, 3 - d]
+        reset = np.where(start_dir == d, np.arange(n_intervals), 0)
+        reset = np.maximum.accumulate(reset)
+        totals = np.cumsum(counts[:, cols], axis=0)
+        offsets = np.vstack((np.zeros((1, 2), dtype=np.int64), totals[:-1]))
+        counts[:, cols] = totals - offsets[reset]
+
+    # Each interval is followed by as many empty ones as fit in the gap
+    gaps = np.zeros(n_intervals, dtype=np.int64)
+    gaps[:-1] = np.maximum(
+        (np.diff(timestamps[starts]) / sample_delta).astype(np.int64) - 1, 0)
+    rows = np.arange(n_intervals) + np.concatenate(([0], np.cumsum(gaps[:-1])))
+
+    bins = np.zeros((rows[-1] + 1, 4), dtype=np.int64)
+    bins[rows] = counts
+
+    return bins
+
+
+def packet_arrays(tcp_packets):
+    local_ip = socket.inet_pton(socket.AF_INET, LOCAL_IP)
+    local_ipv6 = socket.inet_pton(socket.AF_INET6, LOCAL_IPV6)
+    remote_ports = set(REMOTE_PORTS)
+
+    timestamps = array('d')
+    directions = array('b')
+    sizes = array('l')
+
+    for timestamp, src, dst, src_port, dst_port, size in tcp_packets:
+        ip = local_ipv6 if len(src) == 16 else local_ip
+
+        if src == ip and dst_port in remote_ports:
+            directions.append(0)
+        elif src_port in remote_ports and dst == ip:
+            directions.append(1)
+        else:
+            continue
+
+        timestamps.append(timestamp)
+        sizes.append(size)
+
+    return np.frombuffer(timestamps, dtype=np.float64), \
+        np.frombuffer(directions, dtype=np.int8).astype(np.int64), \
+        np.frombuffer(sizes, dtype=sizes.typecode).astype(np.int64)
+
+
+def process_packets(tcp_packets):
+    timestamps, directions, sizes = packet_arrays(tcp_packets)
+    save_to_file(bin_packets(timestamps, directions, sizes))
+
+
+def flow_arrays(tcp_packets):
+    """Splits a capture into (local host, remote port) flows.
+
+    Local hosts are the addresses inside CLIENT_NETS_SET. Returns the flows
+    as a list of (address, port) tuples and the timestamps, flow index,
+    direction and size of every packet that belongs to one of them.
+    """
+    addresses = {}
+    timestamps = array('d')
+    srcs = array('l')
+    dsts = array('l')
+    src_ports = array('l')
+    dst_ports = array('l')
+    sizes = array('l')
+
+    # Intern addresses during the pass, subnet lookups are done once per host
+    for timestamp, src, dst, src_port, dst_port, size in tcp_packets:
+        timestamps.append(timestamp)
+        srcs.append(addresses.setdefault(src, len(addresses)))
+        dsts.append(addresses.setdefault(dst, len(addresses)))
+        src_ports.append(src_port)
+        dst_ports.append(dst_port)
+        sizes.append(size)
+
+    hosts = [IPAddress(int.from_bytes(a, 'big'), 6 if len(a) == 16 else 4)
+             for a in addresses]
+    is_local = np.array([h in CLIENT_NETS_SET for h in hosts], dtype=bool)
+
+    srcs = np.frombuffer(srcs, dtype=srcs.typecode)
+    dsts = np.frombuffer(dsts, dtype=dsts.typecode)
+    src_ports = np.frombuffer(src_ports, dtype=src_ports.typecode)
+    dst_ports = np.frombuffer(dst_ports, dtype=dst_ports.typecode)
+
+    if ALL_PORTS:
+        dst_remote = np.ones(len(dst_ports), dtype=bool)
+        src_remote = dst_remote
+    else:
+        dst_remote = np.isin(dst_ports, REMOTE_PORTS)
+        src_remote = np.isin(src_ports, REMOTE_PORTS)
+
+    if len(hosts) > 0:
+        sent = is_local[srcs] & dst_remote
+        received = ~sent & is_local[dsts] & src_remote
+    else:
+        sent = received = np.zeros(0, dtype=bool)
+    selected = sent | received
+
+    local = np.where(sent, srcs, dsts)[selected]
+    remote_port = np.where(sent, dst_ports, src_ports)[selected]
+    keys, flow_idx = np.unique(local * 65536 + remote_port, return_inverse=True)
+    flows = [(hosts[k // 65536], int(k % 65536)) for k in keys]
+
+    return flows, np.frombuffer(timestamps, dtype=np.float64)[selected], \
+        flow_idx, received[selected].astype(np.int64), \
+        np.frombuffer(sizes, dtype=sizes.typecode)[selected].astype(np.int64)
+
+
+def flow_filename(address, port):
+    return '{}_{}.dat'.format(str(address).replace(':', '-'), port)
+
+
+def process_flows(tcp_packets, outdir_path):
+    flows, timestamps, flow_idx, directions, sizes = flow_arrays(tcp_packets)
+
+    # Packets of each flow become contiguous, still in capture order
+    order = np.argsort(flow_idx, kind='stable')
+    bounds = np.searchsorted(flow_idx[order], np.arange(len(flows) + 1))
+
+    os.makedirs(outdir_path, exist_ok=True)
+    for f, (address, port) in enumerate(flows):
+        idx = order[bounds[f]:bounds[f + 1]]
+        bins = bin_packets(timestamps[idx], directions[idx], sizes[idx])
+        save_to_file(bins, os.path.join(outdir_path, flow_filename(address, port)))
+
+    return flows
 
 
 def main():
@@ -95,18 +257,32 @@ def main():
     global SAMPLE_DELTA
     global LOCAL_IP
     global LOCAL_IPV6
+    global REMOTE_PORTS
+    global BACKEND
+    global CLIENT_NETS_SET
+    global ALL_PORTS
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', nargs='?',
             help='input capture file')
     parser.add_argument('-o', '--output', nargs='?',
-            help='output processed file')
-    parser.add_argument('-w', '--sampwindow', nargs='?',
+            help='output processed file (output directory with --cnet)')
+    parser.add_argument('-w', '--sampwindow', nargs='?', type=float,
             help='sampling interval (default 0.5s)')
     parser.add_argument('-4', '--ipv4', nargs='?',
             help='IPv4 of the host machine')
     parser.add_argument('-6', '--ipv6', nargs='?',
             help='IPv6 of the host machine')
+    parser.add_argument('-b', '--backend', nargs='?',
+            choices=['native', 'pyshark'],
+            help='capture reader backend (default: native)')
+    parser.add_argument('-c', '--cnet', nargs='+',
+            help='client network(s), writes one file per local host and '
+                 'remote port')
+    parser.add_argument('-p', '--ports', nargs='+', type=int,
+            help='remote TCP ports (default: {})'.format(REMOTE_PORTS))
+    parser.add_argument('-a', '--allports', action='store_true', default=False,
+            help='accept any remote TCP port (default: false)')
     args = parser.parse_args()
 
     INFILE_PATH = args.input if args.input is not None else INFILE_PATH
@@ -114,6 +290,32 @@ def main():
     SAMPLE_DELTA = args.sampwindow if args.sampwindow is not None else SAMPLE_DELTA
     LOCAL_IP = args.ipv4 if args.ipv4 is not None else LOCAL_IP
     LOCAL_IPV6 = args.ipv6 if args.ipv6 is not None else LOCAL_IPV6
+    BACKEND = args.backend if args.backend is not None else BACKEND
+    REMOTE_PORTS = args.ports if args.ports is not None else REMOTE_PORTS
+    ALL_PORTS = args.allports
+
+    if args.cnet is not None:
+        try:
+            CLIENT_NETS_SET = IPSet([IPNetwork(n) for n in args.cnet])
+        except Exception:
+            print('ERROR: Invalid client network prefix!')
+            exit(1)
+
+        # Checked before reading the capture, the default output is a file
+        if args.output is None:
+            print('ERROR: An output directory (-o) is required with --cnet!')
+            exit(1)
+        if os.path.exists(OUTFILE_PATH) and not os.path.isdir(OUTFILE_PATH):
+            print('ERROR: Output {} is not a directory!'.format(OUTFILE_PATH))
+            exit(1)
+
+        if os.path.isdir(OUTFILE_PATH) and len(os.listdir(OUTFILE_PATH)) > 0:
+            if input('Write over files in directory? [y/N] ') != 'y':
+                exit()
+
+        flows = process_flows(read_packets(INFILE_PATH, BACKEND), OUTFILE_PATH)
+        print('{} flows written to {}'.format(len(flows), OUTFILE_PATH))
+        return
 
     if os.path.exists(OUTFILE_PATH):
         if input('Write over file? [y/N] ') == 'y':
@@ -121,10 +323,7 @@ def main():
         else:
             exit()
 
-    tcp_cap = pyshark.FileCapture(
-            INFILE_PATH, display_filter='tcp', keep_packets=False)
-
-    process_packets(tcp_cap)
+    process_packets(read_packets(INFILE_PATH, BACKEND))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,242 @@
+import mmap
+import struct
+
+# Capture link types we know how to strip down to the network layer
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+
+IPPROTO_TCP = 6
+IPV6_EXT_HEADERS = (0, 43, 60)  # hop-by-hop, routing, destination options
+IPV6_FRAGMENT = 44
+IPV6_AH = 51
+
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e9),
+}
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_PB = 0x00000002
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_OPT_TSRESOL = 9
+PCAPNG_OPT_TSOFFSET = 14
+
+
+def network_offset(linktype, buf, offset, caplen):
+    """Returns (ip_version, offset of the IP header) or None"""
+    end = offset + caplen
+
+    if linktype == LINKTYPE_ETHERNET:
+        if caplen < 14:
+            return None
+        ethertype = struct.unpack_from('>H', buf, offset + 12)[0]
+        offset += 14
+        while ethertype in ETHERTYPE_VLAN and offset + 4 <= end:
+            ethertype = struct.unpack_from('>H', buf, offset + 2)[0]
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if caplen < 16:
+            return None
+        ethertype = struct.unpack_from('>H', buf, offset + 14)[0]
+        offset += 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if caplen < 20:
+            return None
+        ethertype = struct.unpack_from('>H', buf, offset)[0]
+        offset += 20
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        # Address family is in host (NULL) or network (LOOP) byte order,
+        # the version nibble of the IP header is enough to tell them apart
+        offset += 4
+        ethertype = None
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        ethertype = None
+    else:
+        return None
+
+    if offset >= end:
+        return None
+
+    if ethertype is None:
+        version = buf[offset] >> 4
+    elif ethertype == ETHERTYPE_IPV4:
+        version = 4
+    elif ethertype == ETHERTYPE_IPV6:
+        version = 6
+    else:
+        return None
+
+    return version, offset
+
+
+def decode_tcp(version, buf, offset, end):
+    """Returns (src, dst, src_port, dst_port, size) of a TCP segment or None.
+
+    Addresses are returned packed (4 or 16 bytes). The size is the IPv4 total
+    length or the IPv6 payload length, as reported by tshark.
+    """
+    if version == 4:
+        if offset + 20 > end:
+            return None
+        ihl = (buf[offset] & 0x0F) * 4
+        size, frag = struct.unpack_from('>H2xH', buf, offset + 2)
+        # Only the first fragment carries the TCP header
+        if buf[offset + 9] != IPPROTO_TCP or frag & 0x1FFF:
+            return None
+        src = buf[offset + 12:offset + 16]
+        dst = buf[offset + 16:offset + 20]
+        offset += ihl
+    elif version == 6:
+        if offset + 40 > end:
+            return None
+        size = struct.unpack_from('>H', buf, offset + 4)[0]
+        next_header = buf[offset + 6]
+        src = buf[offset + 8:offset + 24]
+        dst = buf[offset + 24:offset + 40]
+        offset += 40
+        while next_header != IPPROTO_TCP:
+            if offset + 8 > end:
+                return None
+            if next_header in IPV6_EXT_HEADERS:
+                length = (buf[offset + 1] + 1) * 8
+            elif next_header == IPV6_FRAGMENT:
+                if struct.unpack_from('>H', buf, offset + 2)[0] & 0xFFF8:
+                    return None
+                length = 8
+            elif next_header == IPV6_AH:
+                length = (buf[offset + 1] + 2) * 4
+            else:
+                return None
+            next_header = buf[offset]
+            offset += length
+    else:
+        return None
+
+    if offset + 4 > end:
+        return None
+    src_port, dst_port = struct.unpack_from('>HH', buf, offset)
+
+    return src, dst, src_port, dst_port, size
+
+
+def pcap_records(buf):
+    endian, resolution = PCAP_MAGIC[bytes(buf[:4])]
+    linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0x0FFFFFFF
+    record = struct.Struct(endian + 'IIII')
+    offset = 24
+    n = len(buf)
+
+    while offset + 16 <= n:
+        ts_sec, ts_frac, caplen, _ = record.unpack_from(buf, offset)
+        offset += 16
+        if offset + caplen > n:
+            break
+        yield ts_sec + ts_frac / resolution, linktype, offset, caplen
+        offset += caplen
+
+
+def pcapng_tsresol(value):
+    if value & 0x80:
+        return float(2 ** (value & 0x7F))
+    return float(10 ** value)
+
+
+def pcapng_records(buf):
+    endian = '<'
+    interfaces = []
+    offset = 0
+    n = len(buf)
+
+    while offset + 12 <= n:
+        block_type = struct.unpack_from('<I', buf, offset)[0]
+
+        if block_type == PCAPNG_SHB:
+            magic = struct.unpack_from('<I', buf, offset + 8)[0]
+            endian = '<' if magic == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            interfaces = []
+        else:
+            block_type = struct.unpack_from(endian + 'I', buf, offset)[0]
+
+        block_len = struct.unpack_from(endian + 'I', buf, offset + 4)[0]
+        if block_len < 12 or offset + block_len > n:
+            break
+        body = offset + 8
+        block_end = offset + block_len - 4
+
+        if block_type == PCAPNG_IDB:
+            linktype = struct.unpack_from(endian + 'H', buf, body)[0]
+            resolution, ts_offset = 1e6, 0
+            opt = body + 8
+            while opt + 4 <= block_end:
+                code, length = struct.unpack_from(endian + 'HH', buf, opt)
+                if code == 0:
+                    break
+                if code == PCAPNG_OPT_TSRESOL:
+                    resolution = pcapng_tsresol(buf[opt + 4])
+                elif code == PCAPNG_OPT_TSOFFSET:
+                    ts_offset = struct.unpack_from(endian + 'q', buf, opt + 4)[0]
+                opt += 4 + (length + 3) // 4 * 4
+            interfaces.append((linktype, resolution, ts_offset))
+
+        elif block_type in (PCAPNG_EPB, PCAPNG_PB):
+            if block_type == PCAPNG_EPB:
+                if_id, ts_high, ts_low, caplen = \
+                    struct.unpack_from(endian + 'IIII', buf, body)
+            else:
+                if_id, ts_high, ts_low, caplen = \
+                    struct.unpack_from(endian + 'HxxIII', buf, body)
+            data = body + 20
+            if if_id < len(interfaces) and data + caplen <= block_end:
+                linktype, resolution, ts_offset = interfaces[if_id]
+                ts = (ts_high << 32) | ts_low
+                seconds, frac = divmod(ts, int(resolution))
+                yield ts_offset + seconds + frac / resolution, linktype, \
+                    data, caplen
+
+        offset += block_len
+
+
+def read_tcp_packets(path):
+    """Iterates over the TCP packets of a pcap/pcapng capture.
+
+    Yields (timestamp, src, dst, src_port, dst_port, size) tuples without
+    dissecting anything but the link, IP and TCP headers.
+    """
+    with open(path, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return
+
+    with buf:
+        magic = bytes(buf[:4])
+        if magic in PCAP_MAGIC:
+            records = pcap_records(buf)
+        elif len(buf) >= 4 and \
+                struct.unpack_from('<I', buf, 0)[0] == PCAPNG_SHB:
+            records = pcapng_records(buf)
+        else:
+            raise ValueError('{} is not a pcap/pcapng capture'.format(path))
+
+        for timestamp, linktype, offset, caplen in records:
+            net = network_offset(linktype, buf, offset, caplen)
+            if net is None:
+                continue
+            tcp = decode_tcp(net[0], buf, net[1], offset + caplen)
+            if tcp is None:
+                continue
+            yield (timestamp,) + tcp
@@ -0,0 +1,126 @@
+import os
+import json
+import pickle
+import argparse
+import numpy as np
+
+STORE_DIR = 'profiled-data/store'
+PICKLE_PATH = 'profiled-data/input_data.pkl'
+STORE_VERSION = 1
+META_FILE = 'meta.json'
+BLOCKS = ('unnorm_train', 'unnorm_test', 'norm_train', 'norm_test')
+
+
+def block_path(store_dir, name):
+    return os.path.join(store_dir, name + '.npy')
+
+
+def save_store(blocks, classes, samples_number, store_dir=None):
+    """Saves the profiled data as one .npy file per block and a meta file.
+
+    The meta file is written last, so a store is only visible once all of
+    its blocks are.
+    """
+    store_dir = STORE_DIR if store_dir is None else store_dir
+    os.makedirs(store_dir, exist_ok=True)
+    meta = {
+        'version': STORE_VERSION,
+        'classes': [[int(k), v] for k, v in classes.items()],
+        'samples_number': [int(n) for n in samples_number],
+        'blocks': {},
+    }
+
+    for name, data in blocks.items():
+        path = block_path(store_dir, name)
+        tmp_path = path[:-len('.npy')] + '.tmp.npy'
+        np.save(tmp_path, data)
+        os.replace(tmp_path, path)
+        meta['blocks'][name] = list(np.shape(data))
+
+    tmp_path = os.path.join(store_dir, META_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp_path, os.path.join(store_dir, META_FILE))
+
+
+def read_meta(store_dir):
+    with open(os.path.join(store_dir, META_FILE)) as f:
+        meta = json.load(f)
+    if meta['version'] > STORE_VERSION:
+        raise ValueError('Unsupported profiled data version {} in {}'.format(
+            meta['version'], store_dir))
+    return meta
+
+
+def is_store(path):
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def load_store(store_dir=None, blocks=BLOCKS):
+    """Loads the classes, sample counts and the given blocks of a store.
+
+    Blocks are memory mapped read only, nothing else is read from disk.
+    """
+    store_dir = STORE_DIR if store_dir is None else store_dir
+    meta = read_meta(store_dir)
+    d = {
+        'classes': {k: v for k, v in meta['classes']},
+        'samples_number': meta['samples_number'],
+    }
+    for name in blocks:
+        if name not in meta['blocks']:
+            raise KeyError('No {} block in {}'.format(name, store_dir))
+        d[name] = np.load(block_path(store_dir, name), mmap_mode='r')
+
+    return d
+
+
+def load_pickle(pickle_path=None, blocks=BLOCKS):
+    pickle_path = PICKLE_PATH if pickle_path is None else pickle_path
+    with open(pickle_path, 'rb') as f:
+        d = pickle.load(f)
+
+    # Out of core matrices were saved by reference
+    for name in BLOCKS:
+        if name not in blocks:
+            del d[name]
+        elif isinstance(d[name], str):
+            d[name] = np.load(d[name], mmap_mode='r')
+
+    return d
+
+
+def load_profiled_data(path=None, blocks=BLOCKS):
+    """Loads profiled data from a store, or from a legacy pickle file.
+
+    Without a path the default store is used if it exists, the default
+    pickle file otherwise.
+    """
+    if path is None:
+        path = STORE_DIR if is_store(STORE_DIR) else PICKLE_PATH
+
+    if os.path.isdir(path):
+        return load_store(path, blocks)
+    return load_pickle(path, blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', nargs='?', default=PICKLE_PATH,
+            help='pickled profiled data (default: {})'.format(PICKLE_PATH))
+    parser.add_argument('-o', '--output', nargs='?', default=STORE_DIR,
+            help='store directory (default: {})'.format(STORE_DIR))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print('ERROR: Invalid input file!')
+        exit(1)
+
+    d = load_pickle(args.input)
+    save_store({name: d[name] for name in BLOCKS}, d['classes'],
+               d['samples_number'], args.output)
+    print('{} -> {}'.format(args.input, args.output))
+
+
+if __name__ == '__main__':
+    main()
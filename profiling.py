@@ -2,15 +2,39 @@ import numpy as np
 import scipy.stats as stats
 import matplotlib.pyplot as plt
 from sklearn.externals import joblib
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
 from sklearn.preprocessing import StandardScaler
+import os
 import sys
 import warnings
-import scalogram
+import multiprocessing
+import dataset_format
+import feature_cache
+import model_registry
+import compact_models
+import live_inference
+import generate_merge_datasets
+from window_features import observation_windows, train_test_indices, \
+    break_train_test, window_chunks, extract_features, extract_silence, \
+    silence_statistics, extract_features_silence, extract_features_wavelet
 from itertools import cycle
 
 warnings.filterwarnings('ignore')
 
+# Bump whenever the extracted feature values change, invalidates the cache
+FEATURES_VERSION = 2
+PROFILING_OUTPUTS = ('features', 'features_silence', 'features_wavelet',
+                     'test_features', 'test_features_silence',
+                     'test_features_wavelet', 'n_obs_windows')
+
+# Out of core training: rows of the feature matrices handled at once and
+# where the disk backed matrices are kept
+TRAIN_BATCH = 4096
+OUT_OF_CORE_DIR = 'profiled-data/out-of-core'
+
+# Training rows the exported live projection is checked on
+PROJECTION_CHECK_ROWS = 1000
+
 
 def wait_for_enter(fstop=True):
     if fstop:
@@ -57,194 +81,187 @@ def plot_features(features, traffic_classes, feature1_idx=0, feature2_idx=1):
     plt.show()
 
 
-def break_train_test(data, obs_window=840, slide_window=40,
-                     train_percentage=0.5, random_split=True):
-    if len(data) <= obs_window:
-        return np.array([data]), np.array([data])
+def extract_live_features(data_test, obs_window=840, slide_window=40):
+    return live_inference.extract_live_features(data_test, obs_window,
+                                                slide_window)
 
-    window_size = int(obs_window / slide_window)
-    n_samples, n_cols = data.shape
-    n_obs_windows = int((n_samples - obs_window) / slide_window)
-    n_samples = (n_obs_windows - 1) * slide_window + obs_window
-    n_slide_windows = n_obs_windows + window_size - 1
-    data = data[:n_samples, :]
 
-    data_slices = data.reshape((n_slide_windows, slide_window, n_cols))
-    data_obs = np.array([np.concatenate(data_slices[i:window_size + i], axis=0)
-                         for i in range(n_obs_windows)])
+def load_traffic_dataset(dataset_path, offsets=None):
+    # A sequence of paths is merged on the fly instead of read from disk
+    if isinstance(dataset_path, str):
+        return [dataset_path], dataset_format.load_dataset(dataset_path)
 
-    order = np.random.permutation(n_obs_windows) \
-        if random_split else np.arange(n_obs_windows)
+    dataset_paths = list(dataset_path)
+    return dataset_paths, \
+        generate_merge_datasets.merge_datasets(dataset_paths, offsets)
 
-    n_train_windows = int(n_obs_windows * train_percentage)
-    data_train = data_obs[order[:n_train_windows], :, :]
-    data_test = data_obs[order[n_train_windows:], :, :]
 
-    return data_train, data_test
+def traffic_profiling(dataset_path, traffic_class, plot=True,
+                      train_percentage=0.5, obs_window=840, slide_window=40,
+                      scales=[2, 4], use_cache=True, offsets=None):
+    dataset_paths, dataset = load_traffic_dataset(dataset_path, offsets)
 
+    if plot:
+        plot_traffic_class(dataset, traffic_class)
 
-def extract_features(data):
-    percentils = [75, 90, 95]
-    n_obs_windows, n_samples, n_cols = data.shape
-    features = []
-    empty_windows = []
-    for i in range(n_obs_windows):
-        mean = np.mean(data[i, :, :], axis=0)
-        if mean[2] == 0.0 and mean[3] == 0.0:
-            empty_windows.append(i)
-        else:
-            features.append(np.hstack((
-                mean,
-                np.median(data[i, :, :], axis=0),
-                np.std(data[i, :, :], axis=0),
-                np.array(np.percentile(data[i, :, :], percentils, axis=0)).T.flatten(),
-            )))
-    return empty_windows, np.array(features)
+    if use_cache:
+        key = feature_cache.cache_key(
+            feature_cache.dataset_hash(dataset_paths, dataset, offsets),
+            offsets=None if offsets is None else [int(o) for o in offsets],
+            train_percentage=train_percentage, obs_window=obs_window,
+            slide_window=slide_window, scales=list(scales),
+            version=FEATURES_VERSION)
+        cached = feature_cache.load(key)
+        if cached is not None:
+            return tuple(cached[name] for name in PROFILING_OUTPUTS[:-1]) + \
+                (int(cached['n_obs_windows']),)
 
+    data_train, data_test = break_train_test(
+        dataset, obs_window, slide_window, train_percentage=train_percentage,
+        random_split=False)
+    empty_windows_train, features = extract_features(data_train)
+    empty_windows_test, test_features = extract_features(data_test)
+    features_silence = extract_features_silence(data_train, empty_windows_train)
+    test_features_silence = extract_features_silence(data_test, empty_windows_test)
+    features_wavelet = extract_features_wavelet(data_train, empty_windows_train, scales)
+    test_features_wavelet = extract_features_wavelet(data_test, empty_windows_test, scales)
+    n_obs_windows = int(data_train.shape[0] - np.count_nonzero(empty_windows_test))
 
-def extract_silence(data, threshold=256):
-    s = [1] if data[0] <= threshold else []
+    outputs = (features, features_silence, features_wavelet, test_features,
+               test_features_silence, test_features_wavelet, n_obs_windows)
 
-    for i in range(1, len(data)):
-        if data[i] <= threshold:
-            if data[i - 1] > threshold:
-                s.append(1)
-            elif data[i - 1] <= threshold:
-                s[-1] += 1
+    if use_cache:
+        feature_cache.store(key, dict(zip(PROFILING_OUTPUTS, outputs)))
 
-    return s[1:-1] if len(s) > 2 else [0]
+    return outputs
 
 
-def extract_features_silence(data, empty_windows):
-    features = []
-    n_obs_windows, n_samples, n_cols = data.shape
+def normalize_live_features(test_features):
+    return live_inference.normalize_live_features(test_features)
 
-    for i in range(n_obs_windows):
-        if i in empty_windows:
-            continue
-        silence_features = np.array([])
-        for c in range(n_cols):
-            silence = extract_silence(data[i, :, c], threshold=0)
-            silence_features = np.append(
-                silence_features, [np.mean(silence), np.var(silence)])
 
-        features.append(silence_features)
+def checked_projection(scaler, pca, features):
+    # Checked against the two step path before any model is saved
+    projection = compact_models.export_projection(scaler, pca)
+    if not compact_models.check_projection(
+            projection, scaler, pca, features[:PROJECTION_CHECK_ROWS]):
+        raise ValueError('Fused projection does not match the scaler and PCA')
+    return projection
 
-    return np.array(features)
 
+def save_normalization(scaler, pca, projection):
+    # The projection is saved last, never older than the models it fuses
+    joblib.dump(scaler, 'classification-model/scaler.sav')
+    joblib.dump(pca, 'classification-model/pca_model.sav')
+    compact_models.save_model(os.path.join(model_registry.MODEL_DIR,
+                                           live_inference.PROJECTION_MODEL),
+                              projection)
 
-def extract_features_wavelet(data, empty_windows, scales=[2, 4, 8, 16, 32]):
-    features = []
-    n_obs_windows, n_samples, n_cols = data.shape
 
-    for i in range(n_obs_windows):
-        if i in empty_windows:
-            continue
-        scalogram_features = np.array([])
-        for c in range(n_cols):
-            scalo, fscales = scalogram.scalogramCWT(data[i, :, c], scales)
-            scalogram_features = np.append(scalogram_features, scalo)
+def normalize_train_features(features, test_features):
+    scaler = StandardScaler()
+    scaler.fit(features)
+    normalized_features = scaler.transform(features)
+    normalized_test_features = scaler.transform(test_features)
 
-        features.append(scalogram_features)
+    pca = PCA(n_components=25, svd_solver='full')
+    pca.fit(normalized_features)
+    normalized_pca_features = pca.transform(normalized_features)
+    normalized_pca_test_features = pca.transform(normalized_test_features)
 
-    return np.array(features)
+    save_normalization(scaler, pca, checked_projection(scaler, pca, features))
 
+    return normalized_pca_features, normalized_pca_test_features
 
-def extract_live_features(data_test):
-    scales = [2, 4]
-    data_train, data_test = break_train_test(
-        data_test, train_percentage=0.0, random_split=False)
-    empty_windows_test, test_features = extract_features(data_test)
-    test_features_silence = extract_features_silence(data_test, empty_windows_test)
-    test_features_wavelet = extract_features_wavelet(data_test, empty_windows_test, scales)
 
-    return test_features, test_features_silence, test_features_wavelet
+def batch_slices(n_rows, batch_size=None, min_rows=1):
+    # A last batch smaller than min_rows is merged into the previous one
+    batch_size = TRAIN_BATCH if batch_size is None else batch_size
+    bounds = list(range(0, n_rows, batch_size)) + [n_rows]
+    if len(bounds) > 2 and bounds[-1] - bounds[-2] < min_rows:
+        del bounds[-2]
+    return [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
 
 
-def traffic_profiling(dataset_path, traffic_class, plot=True,
-                      train_percentage=0.5):
-    dataset = np.loadtxt(dataset_path)
+def normalize_train_features_incremental(features, test_features,
+                                         workdir=OUT_OF_CORE_DIR,
+                                         n_components=25):
+    """Out of core version of normalize_train_features.
 
-    if plot:
-        plot_traffic_class(dataset, traffic_class)
+    The scaler and the PCA are fitted batch by batch and the projected
+    features are written to memory mapped .npy files in workdir.
+    """
+    scaler = StandardScaler()
+    for s in batch_slices(len(features)):
+        scaler.partial_fit(features[s])
 
-    scales = [2, 4]
-    data_train, data_test = break_train_test(
-        dataset, train_percentage=train_percentage, random_split=False)
-    empty_windows_train, features = extract_features(data_train)
-    empty_windows_test, test_features = extract_features(data_test)
-    features_silence = extract_features_silence(data_train, empty_windows_train)
-    test_features_silence = extract_features_silence(data_test, empty_windows_test)
-    features_wavelet = extract_features_wavelet(data_train, empty_windows_train, scales)
-    test_features_wavelet = extract_features_wavelet(data_test, empty_windows_test, scales)
-    n_obs_windows = data_train.shape[0] - len(empty_windows_test)
-    
-    return features, features_silence, features_wavelet, test_features, \
-           test_features_silence, test_features_wavelet, n_obs_windows
+    # Every PCA batch needs at least n_components rows
+    pca = IncrementalPCA(n_components=n_components)
+    for s in batch_slices(len(features), min_rows=n_components):
+        pca.partial_fit(scaler.transform(features[s]))
 
+    save_normalization(scaler, pca, checked_projection(scaler, pca, features))
 
-def normalize_live_features(test_features):
-    scaler = joblib.load('classification-model/scaler.sav')
-    normalized_test_features = scaler.transform(test_features)
+    outputs = []
+    for name, x in (('norm_train', features), ('norm_test', test_features)):
+        path = os.path.join(workdir, name + '.npy')
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                        shape=(len(x), n_components))
+        for s in batch_slices(len(x)):
+            out[s] = pca.transform(scaler.transform(x[s]))
+        out.flush()
+        del out
+        outputs.append(np.load(path, mmap_mode='r'))
 
-    pca = joblib.load('classification-model/pca_model.sav')
-    normalized_pca_test_features = pca.transform(normalized_test_features)
+    return tuple(outputs)
 
-    return normalized_pca_test_features
 
+def profile_job(job):
+    return traffic_profiling(*job)
 
-def normalize_train_features(features, test_features):
-    scaler = StandardScaler()
-    scaler.fit(features)
-    normalized_features = scaler.transform(features)
-    normalized_test_features = scaler.transform(test_features)
 
-    joblib.dump(scaler, 'classification-model/scaler.sav')
+def iter_profile_datasets(traffic_classes, datasets_filepath, use_cache=True,
+                          n_jobs=None):
+    """Runs traffic_profiling for every dataset on a process pool.
 
-    pca = PCA(n_components=25, svd_solver='full')
-    pca.fit(normalized_features)
-    normalized_pca_features = pca.transform(normalized_features)
-    normalized_pca_test_features = pca.transform(normalized_test_features)
+    Results are yielded in the order of datasets_filepath, whatever the
+    order the jobs finish in.
+    """
+    jobs = [(datasets_filepath[d_idx], traffic_classes[d_idx], False, 0.5,
+             840, 40, [2, 4], use_cache) for d_idx in datasets_filepath]
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    n_jobs = max(1, min(n_jobs, len(jobs)))
 
-    joblib.dump(pca, 'classification-model/pca_model.sav')
+    if n_jobs == 1:
+        for job in jobs:
+            yield traffic_profiling(*job)
+        return
+
+    with multiprocessing.Pool(n_jobs) as pool:
+        for result in pool.imap(profile_job, jobs):
+            yield result
 
-    return normalized_pca_features, normalized_pca_test_features
 
+def profile_datasets(traffic_classes, datasets_filepath, use_cache=True,
+                     n_jobs=None):
+    return list(iter_profile_datasets(traffic_classes, datasets_filepath,
+                                      use_cache, n_jobs))
 
-def extract_traffic_features(traffic_classes, datasets_filepath):
+
+def extract_traffic_features(traffic_classes, datasets_filepath, use_cache=True,
+                             n_jobs=None):
     if len(traffic_classes) == 0 \
             or len(traffic_classes) != len(datasets_filepath):
         return None
 
-    features = None
-    features_silence = None
-    features_wavelet = None
-    test_features = None
-    test_features_silence = None
-    test_features_wavelet = None
-    traffic_samples_number = None
-
-    for d_idx in datasets_filepath:
-        d = datasets_filepath[d_idx]
-        f, fs, fw, tf, tfs, tfw, n_obs = \
-            traffic_profiling(d, traffic_classes[d_idx], False)
-
-        if features is None:
-            features = f
-            features_silence = fs
-            features_wavelet = fw
-            test_features = tf
-            test_features_silence = tfs
-            test_features_wavelet = tfw
-            traffic_samples_number = [n_obs]
-        else:
-            features = np.concatenate((features, f))
-            features_silence = np.concatenate((features_silence, fs))
-            features_wavelet = np.concatenate((features_wavelet, fw))
-            test_features = np.concatenate((test_features, tf))
-            test_features_silence = np.concatenate((test_features_silence, tfs))
-            test_features_wavelet = np.concatenate((test_features_wavelet, tfw))
-            traffic_samples_number.append(n_obs)
+    results = profile_datasets(traffic_classes, datasets_filepath, use_cache,
+                               n_jobs)
+
+    # Assemble every feature block once, in dataset order
+    features, features_silence, features_wavelet, test_features, \
+        test_features_silence, test_features_wavelet = \
+        [np.concatenate([r[i] for r in results]) for i in range(6)]
+    traffic_samples_number = [r[6] for r in results]
 
     """
     print('Train Stats Features Size:', features.shape)
@@ -280,7 +297,68 @@ def extract_traffic_features(traffic_classes, datasets_filepath):
            norm_pca_test_features, traffic_classes, traffic_samples_number
 
 
-def profiling():
+def raw_to_npy(raw_path, npy_path, shape):
+    # Copies the first shape[0] rows of a raw float64 file to a .npy file
+    out = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.float64,
+                                    shape=shape)
+    with open(raw_path, 'rb') as f:
+        for s in batch_slices(shape[0]):
+            n = s.stop - s.start
+            out[s] = np.fromfile(f, dtype=np.float64,
+                                 count=n * shape[1]).reshape((n, shape[1]))
+    out.flush()
+    del out
+    os.remove(raw_path)
+
+    return np.load(npy_path, mmap_mode='r')
+
+
+def extract_traffic_features_out_of_core(traffic_classes, datasets_filepath,
+                                         use_cache=True, n_jobs=None,
+                                         workdir=OUT_OF_CORE_DIR):
+    """Out of core version of extract_traffic_features.
+
+    Each dataset's train and test features are appended to files in workdir
+    as soon as it is profiled, so only a few datasets are in memory at a
+    time. The returned matrices are memory mapped .npy files.
+    """
+    if len(traffic_classes) == 0 \
+            or len(traffic_classes) != len(datasets_filepath):
+        return None
+
+    os.makedirs(workdir, exist_ok=True)
+    raw_paths = [os.path.join(workdir, name + '.raw')
+                 for name in ('unnorm_train', 'unnorm_test')]
+    n_rows = [0, 0]
+    n_cols = 0
+    traffic_samples_number = []
+
+    with open(raw_paths[0], 'wb') as train_file, \
+            open(raw_paths[1], 'wb') as test_file:
+        for r in iter_profile_datasets(traffic_classes, datasets_filepath,
+                                       use_cache, n_jobs):
+            for i, f in enumerate((train_file, test_file)):
+                block = np.hstack(r[3 * i:3 * i + 3]).astype(np.float64)
+                f.write(np.ascontiguousarray(block).tobytes())
+                n_rows[i] += block.shape[0]
+                n_cols = block.shape[1]
+            traffic_samples_number.append(r[6])
+
+    # Testing features (size must be the same than the training)
+    feature_size = min(n_rows)
+    all_features, all_test_features = [
+        raw_to_npy(raw_path, raw_path[:-len('.raw')] + '.npy',
+                   (feature_size, n_cols)) for raw_path in raw_paths]
+
+    norm_pca_train_features, norm_pca_test_features = \
+        normalize_train_features_incremental(all_features, all_test_features,
+                                             workdir)
+
+    return all_features, all_test_features, norm_pca_train_features, \
+           norm_pca_test_features, traffic_classes, traffic_samples_number
+
+
+def profiling(use_cache=True, n_jobs=None, out_of_core=False):
     traffic_classes = {
         0: 'YouTube',
         1: 'Netflix',
@@ -330,12 +408,12 @@ def profiling():
         2: 'datasets/browsing.dat',
         3: 'datasets/social-network.dat',
         4: 'datasets/email.dat',
-        5: 'merged-datasets/browsing_netflix.dat',
-        6: 'merged-datasets/browsing_social-network.dat',
-        7: 'merged-datasets/browsing_youtube.dat',
-        8: 'merged-datasets/netflix_social-network.dat',
-        9: 'merged-datasets/netflix_youtube.dat',
-        10: 'merged-datasets/social-network_youtube.dat',
+        5: ('datasets/browsing.dat', 'datasets/netflix.dat'),
+        6: ('datasets/browsing.dat', 'datasets/social-network.dat'),
+        7: ('datasets/browsing.dat', 'datasets/youtube.dat'),
+        8: ('datasets/netflix.dat', 'datasets/social-network.dat'),
+        9: ('datasets/netflix.dat', 'datasets/youtube.dat'),
+        10: ('datasets/social-network.dat', 'datasets/youtube.dat'),
         11: 'vpn-datasets/vpn-netflix.dat',
         12: 'vpn-datasets/vpn-youtube.dat',
         13: 'datasets/mining_4t_nicehash.dat',
@@ -343,32 +421,37 @@ def profiling():
         15: 'datasets/mining_gpu_nicehash_equihash_1070_60p.dat',
         16: 'datasets/mining_gpu_nicehash_equihash_1080ti_85p.dat',
         17: 'datasets/mining_gpu_nicehash_equihash_1080ti_100p.dat',
-        #18: 'merged-datasets/mining_4t_nicehash_browsing.dat',
-        #19: 'merged-datasets/mining_4t_nicehash_netflix.dat',
-        #20: 'merged-datasets/mining_4t_nicehash_social-network.dat',
-        #21: 'merged-datasets/mining_4t_nicehash_youtube.dat',
-        #22: 'merged-datasets/mining_2t_nicehash_browsing.dat',
-        #23: 'merged-datasets/mining_2t_nicehash_netflix.dat',
-        #24: 'merged-datasets/mining_2t_nicehash_social-network.dat',
-        #25: 'merged-datasets/mining_2t_nicehash_youtube.dat',
-        18: 'merged-datasets/mining_gpu_nicehash_equihash_1070_60p_browsing.dat',
-        19: 'merged-datasets/mining_gpu_nicehash_equihash_1070_60p_netflix.dat',
-        20: 'merged-datasets/mining_gpu_nicehash_equihash_1070_60p_social-network.dat',
-        21: 'merged-datasets/mining_gpu_nicehash_equihash_1070_60p_youtube.dat',
-        22: 'merged-datasets/mining_gpu_nicehash_equihash_1080ti_85p_browsing.dat',
-        23: 'merged-datasets/mining_gpu_nicehash_equihash_1080ti_85p_netflix.dat',
-        24: 'merged-datasets/mining_gpu_nicehash_equihash_1080ti_85p_social-network.dat',
-        25: 'merged-datasets/mining_gpu_nicehash_equihash_1080ti_85p_youtube.dat',
-        26: 'merged-datasets/mining_gpu_nicehash_equihash_1080ti_100p_browsing.dat',
-        27: 'merged-datasets/mining_gpu_nicehash_equihash_1080ti_100p_netflix.dat',
-        28: 'merged-datasets/mining_gpu_nicehash_equihash_1080ti_100p_social-network.dat',
-        29: 'merged-datasets/mining_gpu_nicehash_equihash_1080ti_100p_youtube.dat',
+        #18: ('datasets/mining_4t_nicehash.dat', 'datasets/browsing.dat'),
+        #19: ('datasets/mining_4t_nicehash.dat', 'datasets/netflix.dat'),
+        #20: ('datasets/mining_4t_nicehash.dat', 'datasets/social-network.dat'),
+        #21: ('datasets/mining_4t_nicehash.dat', 'datasets/youtube.dat'),
+        #22: ('datasets/mining_2t_nicehash.dat', 'datasets/browsing.dat'),
+        #23: ('datasets/mining_2t_nicehash.dat', 'datasets/netflix.dat'),
+        #24: ('datasets/mining_2t_nicehash.dat', 'datasets/social-network.dat'),
+        #25: ('datasets/mining_2t_nicehash.dat', 'datasets/youtube.dat'),
+        18: ('datasets/mining_gpu_nicehash_equihash_1070_60p.dat', 'datasets/browsing.dat'),
+        19: ('datasets/mining_gpu_nicehash_equihash_1070_60p.dat', 'datasets/netflix.dat'),
+        20: ('datasets/mining_gpu_nicehash_equihash_1070_60p.dat', 'datasets/social-network.dat'),
+        21: ('datasets/mining_gpu_nicehash_equihash_1070_60p.dat', 'datasets/youtube.dat'),
+        22: ('datasets/mining_gpu_nicehash_equihash_1080ti_85p.dat', 'datasets/browsing.dat'),
+        23: ('datasets/mining_gpu_nicehash_equihash_1080ti_85p.dat', 'datasets/netflix.dat'),
+        24: ('datasets/mining_gpu_nicehash_equihash_1080ti_85p.dat', 'datasets/social-network.dat'),
+        25: ('datasets/mining_gpu_nicehash_equihash_1080ti_85p.dat', 'datasets/youtube.dat'),
+        26: ('datasets/mining_gpu_nicehash_equihash_1080ti_100p.dat', 'datasets/browsing.dat'),
+        27: ('datasets/mining_gpu_nicehash_equihash_1080ti_100p.dat', 'datasets/netflix.dat'),
+        28: ('datasets/mining_gpu_nicehash_equihash_1080ti_100p.dat', 'datasets/social-network.dat'),
+        29: ('datasets/mining_gpu_nicehash_equihash_1080ti_100p.dat', 'datasets/youtube.dat'),
         30: 'vpn-datasets/vpn-mining-4t.dat',
         31: 'vpn-datasets/vpn-mining-2t.dat',
     }
     plt.ion()
 
-    return extract_traffic_features(traffic_classes, datasets_filepath)
+    if out_of_core:
+        return extract_traffic_features_out_of_core(
+            traffic_classes, datasets_filepath, use_cache, n_jobs)
+
+    return extract_traffic_features(traffic_classes, datasets_filepath,
+                                    use_cache, n_jobs)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
 import numpy
+from functools import lru_cache
 
 
 def round_2_up(num):
@@ -16,25 +17,33 @@ def fMorletWaveletFFT(k, scale, N, precision):
     return basic
 
 
+@lru_cache(maxsize=32)
+def morletFilterBank(N, scales, precision=6):
+    # fMorletWaveletFFT for every scale and non negative frequency bin
+    k = numpy.arange(int(N / 2) + 1)
+    w = k * 2 * numpy.pi / N
+    scales = numpy.array(scales, dtype=float)[:, numpy.newaxis]
+
+    bank = numpy.sqrt(scales) * numpy.power(numpy.pi, 0.25) * (
+        numpy.exp(-numpy.power(w * scales - precision, 2) / 2))
+    bank[:, (k == 0) | (k >= int(N / 2))] = 0
+    bank.flags.writeable = False
+    return bank
+
+
 def CWTfft(data, scales):
-    precision = 6
-    N = round_2_up(len(data))
-    fftForw = numpy.fft.fft(data - numpy.mean(data), n=int(N))  # normalize data to mean zero
-
-    kstart = 0
-    kend = int(N / 2)
-    krange = range(kstart, kend + 1)
-    krangeC = range(kend + 1, int(N))
-    coefs = numpy.empty((0, N))
-    for s in scales:
-        fftBack = []
-        for k in krange:
-            psi = fMorletWaveletFFT(k, s, N, precision)
-            fftBack.append(psi * fftForw[k])
-        for k in krangeC:
-            fftBack.append(0)
-        coefs = numpy.vstack([coefs, abs(numpy.fft.ifft(fftBack))])
-    return (coefs[0:, 0:len(data)])
+    # Transforms every series along the last axis of data at once
+    data = numpy.asarray(data, dtype=float)
+    n_samples = data.shape[-1]
+    N = round_2_up(n_samples)
+    fftForw = numpy.fft.rfft(data - numpy.mean(data, axis=-1, keepdims=True),
+                             n=N)  # normalize data to mean zero
+
+    # Negative frequencies are left at zero, as in the one sided transform
+    fftBack = fftForw[..., numpy.newaxis, :] * \
+        morletFilterBank(N, tuple(numpy.ravel(scales).tolist()))
+    coefs = numpy.abs(numpy.fft.ifft(fftBack, n=N))
+    return coefs[..., 0:n_samples]
 
 
 def scalogramCWT(data, scales):
@@ -43,10 +52,10 @@ def scalogramCWT(data, scales):
     centfrq = (6 + pow(2 + pow(6, 2), 0.5)) / (4 * numpy.pi)
 
     C = abs(numpy.power(C, 2))
-    sC = numpy.sum(C)
+    sC = numpy.sum(C, axis=(-2, -1), keepdims=True)
     C = 100 * C / sC
-    N = C.shape[1]
-    S = numpy.sum(C, axis=1) / N
+    N = C.shape[-1]
+    S = numpy.sum(C, axis=-1) / N
     fixscales = scales / centfrq
 
     return S, fixscales
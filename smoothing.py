@@ -0,0 +1,101 @@
+import numpy as np
+from collections import deque
+
+
+class MajoritySmoother:
+    """Streaming majority vote over the last window_size labels.
+
+    Per-label counts are updated as labels enter and leave the window, so
+    each new label costs O(1). A label is replaced by the window's majority
+    label when it is more than threshold of the window.
+    """
+
+    def __init__(self, window_size=40, threshold=0.60):
+        self.window_size = window_size
+        self.threshold = threshold
+        self.window = deque()
+        self.counts = {}
+        # Labels above threshold, at most 1 / threshold of them
+        self.above = {}
+
+    def above_threshold(self, label):
+        return self.counts.get(label, 0) / len(self.window) > self.threshold
+
+    def push(self, label):
+        self.window.append(label)
+        self.counts[label] = self.counts.get(label, 0) + 1
+
+        if len(self.window) > self.window_size:
+            old = self.window.popleft()
+            self.counts[old] -= 1
+            if self.counts[old] == 0:
+                del self.counts[old]
+
+        # Only the new label can have grown its share of the window
+        for l in [l for l in self.above if not self.above_threshold(l)]:
+            del self.above[l]
+        if self.above_threshold(label):
+            self.above[label] = True
+
+        if len(self.above) == 0:
+            return label
+        return max(self.above, key=self.counts.get)
+
+    def reset(self):
+        self.window.clear()
+        self.counts = {}
+        self.above = {}
+
+
+def majority_blocks(codes, n_labels, threshold):
+    """Majority vote of each row of codes (labels coded 0..n_labels-1).
+
+    Returns the majority label of each row, ties going to the label that
+    occurs first (as Counter does), and whether it is more than threshold
+    of the row.
+    """
+    n_rows, size = codes.shape
+    keys = (np.arange(n_rows)[:, np.newaxis] * n_labels + codes).ravel()
+    counts = np.bincount(keys, minlength=n_rows * n_labels) \
+        .reshape((n_rows, n_labels))
+
+    first = np.full(n_rows * n_labels, size)
+    np.minimum.at(first, keys, np.tile(np.arange(size), n_rows))
+    first = first.reshape((n_rows, n_labels))
+
+    max_counts = counts.max(axis=1)
+    majority = np.argmin(
+        np.where(counts == max_counts[:, np.newaxis], first, size), axis=1)
+
+    return majority, max_counts / size > threshold
+
+
+def smooth_blocks(codes, end, window_size, n_labels, threshold):
+    # Blocks [0, w), [w, 2w), ... and a last one ending at end, in place
+    n_full = (end - 1) // window_size
+    blocks = codes[:n_full * window_size].reshape((n_full, window_size))
+    majority, replace = majority_blocks(blocks, n_labels, threshold)
+    blocks[replace] = majority[replace, np.newaxis]
+
+    last = codes[n_full * window_size:end]
+    majority, replace = majority_blocks(last[np.newaxis], n_labels, threshold)
+    if replace[0]:
+        last[:] = majority[0]
+
+
+def smooth_history(traffic_samples, labels, window_size=40, threshold=0.60):
+    """Vectorized classification.improve_classification_history.
+
+    Same block semantics: for every ts in traffic_samples, in order, the
+    first ts labels are split into window_size blocks starting at 0 (the
+    last one ending at ts) and each block is replaced by its majority label
+    when it is more than threshold of the block.
+    """
+    values, codes = np.unique(np.asarray(labels), return_inverse=True)
+
+    for ts in traffic_samples:
+        ts = min(int(ts), len(codes))
+        if ts > 0:
+            smooth_blocks(codes, ts, window_size, len(values), threshold)
+
+    return list(values[codes])
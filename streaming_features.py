@@ -0,0 +1,178 @@
+import bisect
+import numpy as np
+from collections import deque
+from fractions import Fraction
+import scalogram
+
+
+def sorted_percentile(values, q):
+    # np.percentile (linear method) over an already sorted list
+    n = len(values)
+    virtual = (q / 100) * (n - 1)
+    previous = int(np.floor(virtual))
+    gamma = virtual - previous
+    a = values[previous]
+    b = values[min(previous + 1, n - 1)]
+    diff = b - a
+    return b - diff * (1 - gamma) if gamma >= 0.5 else a + diff * gamma
+
+
+def exact_variance(n, total, total_sq):
+    # Variance from integer sums, computed exactly and rounded once
+    if n == 0:
+        return 0.0
+    return float(Fraction(n * total_sq - total * total, n * n))
+
+
+class SlidingWindowFeatures:
+    """Incremental features of sliding observation windows.
+
+    Samples are summarized per slide (column sums and sums of squares,
+    sorted values and silence runs) so each slide costs O(slide) to add
+    and to expire instead of recomputing every window from scratch. Windows
+    start at multiples of slide_window samples, like break_train_test.
+    Samples must be integer counts, which keeps the sums exact. Scalograms
+    are not decomposable and are computed over the whole window.
+    """
+
+    def __init__(self, n_cols=4, obs_window=840, slide_window=40,
+                 scales=(2, 4), threshold=0, percentils=(75, 90, 95)):
+        self.n_cols = n_cols
+        self.obs_window = obs_window
+        self.slide_window = slide_window
+        self.scales = list(scales)
+        self.threshold = threshold
+        self.percentils = list(percentils)
+
+        self.pending = np.zeros((0, n_cols))
+        self.slides = deque()
+        self.n_samples = 0
+        self.sums = [0] * n_cols
+        self.sums_sq = [0] * n_cols
+        self.sorted = [[] for c in range(n_cols)]
+        # Silence runs as [start, end) sample positions, with their sums
+        self.runs = [deque() for c in range(n_cols)]
+        self.run_sums = [0] * n_cols
+        self.run_sums_sq = [0] * n_cols
+
+    def add_slide(self, slide):
+        start = self.n_samples
+        self.slides.append(slide)
+        self.n_samples += len(slide)
+
+        for c in range(self.n_cols):
+            column = slide[:, c]
+            values = column.astype(np.int64).tolist()
+            self.sums[c] += sum(values)
+            self.sums_sq[c] += sum(v * v for v in values)
+            for v in values:
+                bisect.insort(self.sorted[c], v)
+
+            silent = np.concatenate(([0], column <= self.threshold, [0]))
+            edges = np.diff(silent.astype(np.int8))
+            runs = self.runs[c]
+            for s, e in zip(np.flatnonzero(edges == 1) + start,
+                            np.flatnonzero(edges == -1) + start):
+                s, e = int(s), int(e)
+                if len(runs) > 0 and runs[-1][1] == s:
+                    # Continues the last run of the previous slide
+                    s = runs[-1][0]
+                    self.drop_run(c, runs.pop())
+                runs.append((s, e))
+                self.run_sums[c] += e - s
+                self.run_sums_sq[c] += (e - s) * (e - s)
+
+    def drop_run(self, c, run):
+        self.run_sums[c] -= run[1] - run[0]
+        self.run_sums_sq[c] -= (run[1] - run[0]) * (run[1] - run[0])
+
+    def expire_slide(self):
+        slide = self.slides.popleft()
+        window_start = self.n_samples - len(self.slides) * self.slide_window
+
+        for c in range(self.n_cols):
+            values = slide[:, c].astype(np.int64).tolist()
+            self.sums[c] -= sum(values)
+            self.sums_sq[c] -= sum(v * v for v in values)
+            for v in values:
+                del self.sorted[c][bisect.bisect_left(self.sorted[c], v)]
+
+            runs = self.runs[c]
+            while len(runs) > 0 and runs[0][1] <= window_start:
+                self.drop_run(c, runs.popleft())
+
+    def window_features(self):
+        n = self.obs_window
+        mean = [s / n for s in self.sums]
+
+        if mean[2] == 0.0 and mean[3] == 0.0:
+            return True, None, None, None
+
+        median = [sorted_percentile(v, 50) for v in self.sorted]
+        std = [np.sqrt(exact_variance(n, s, sq))
+               for s, sq in zip(self.sums, self.sums_sq)]
+        percentiles = [sorted_percentile(v, q)
+                       for v in self.sorted for q in self.percentils]
+        features = np.array(mean + median + std + percentiles)
+
+        # First and last runs of the window are discarded, whether or not
+        # they were clipped by its edges
+        silence = []
+        for c in range(self.n_cols):
+            runs = self.runs[c]
+            if len(runs) <= 2:
+                silence += [0.0, 0.0]
+                continue
+            k = len(runs) - 2
+            edge_runs = [runs[0][1] - runs[0][0], runs[-1][1] - runs[-1][0]]
+            total = self.run_sums[c] - sum(edge_runs)
+            total_sq = self.run_sums_sq[c] - sum(r * r for r in edge_runs)
+            silence += [total / k, exact_variance(k, total, total_sq)]
+
+        window = np.concatenate(self.slides)
+        scalo, fscales = scalogram.scalogramCWT(window.T, self.scales)
+
+        return False, features, np.array(silence), scalo.flatten()
+
+    def push(self, samples):
+        """Adds samples and returns the features of the completed windows.
+
+        Returns the empty windows mask and the statistical, silence and
+        wavelet features of the non empty windows, as the batch extractors
+        in window_features do.
+        """
+        samples = np.asarray(samples, dtype=np.float64).reshape((-1, self.n_cols))
+        self.pending = np.vstack((self.pending, samples))
+        window_slides = self.obs_window // self.slide_window
+        results = []
+
+        while len(self.pending) >= self.slide_window:
+            slide = self.pending[:self.slide_window]
+            self.pending = self.pending[self.slide_window:]
+
+            self.add_slide(slide)
+            if len(self.slides) > window_slides:
+                self.expire_slide()
+            if len(self.slides) == window_slides:
+                results.append(self.window_features())
+
+        empty_windows = np.array([r[0] for r in results], dtype=bool)
+        valid = [r for r in results if not r[0]]
+        n_features = (3 + len(self.percentils)) * self.n_cols
+
+        return empty_windows, \
+            np.array([r[1] for r in valid]).reshape((-1, n_features)), \
+            np.array([r[2] for r in valid]).reshape((-1, 2 * self.n_cols)), \
+            np.array([r[3] for r in valid]).reshape(
+                (-1, len(self.scales) * self.n_cols))
+
+
+def combine_windows(results, n_obs_windows=None):
+    """Concatenates push() outputs, keeping the first n_obs_windows windows"""
+    empty_windows = np.concatenate([r[0] for r in results])
+    if n_obs_windows is not None:
+        empty_windows = empty_windows[:n_obs_windows]
+    n_valid = np.count_nonzero(~empty_windows)
+
+    return (empty_windows,) + tuple(
+        np.vstack([r[i] for r in results])[:n_valid] for i in range(1, 4))
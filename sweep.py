@@ -0,0 +1,209 @@
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from sklearn import svm
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import confusion_matrix
+from sklearn.neural_network import MLPClassifier
+import classification
+import profiling
+import profiled_store
+import smoothing
+
+MINING_CLASS_START = 13
+WINDOW_SIZES = [1, 40, 50, 70]
+THRESHOLDS = [0.55, 0.60]
+RESULT_FIELDS = ['classifier', 'n_classes', 'window_size', 'threshold', 'tp',
+                 'fn', 'fp', 'tn', 'precision', 'recall', 'accuracy',
+                 'fit_time', 'windows_per_sec', 'confusion_matrix']
+
+# Profiled data of the worker processes, set once by init_worker
+_data = None
+
+
+class NearestCentroid:
+    def __init__(self, traffic_classes):
+        self.traffic_classes = traffic_classes
+
+    def fit(self, features, obs_classes):
+        self.centroids = classification.get_centroids(
+            self.traffic_classes, obs_classes, features)
+        return self
+
+    def predict(self, features):
+        return np.array(list(classification.classification_distances(
+            self.centroids, features).values()))
+
+
+class GaussianClasses(NearestCentroid):
+    def fit(self, features, obs_classes):
+        self.means = classification.get_centroids(
+            self.traffic_classes, obs_classes, features)
+        self.covs = classification.get_covariances(
+            self.traffic_classes, obs_classes, features)
+        return self
+
+    def predict(self, features):
+        return np.argmax(classification.gaussian_log_likelihoods(
+            self.means, self.covs, np.asarray(features)), axis=1)
+
+
+# Same models as the classification_* functions, fitted without saving them
+CLASSIFIERS = {
+    'svc': lambda classes: svm.SVC(kernel='linear'),
+    'svc_rbf': lambda classes: svm.SVC(kernel='rbf'),
+    'svc_poly': lambda classes: svm.SVC(kernel='poly', degree=2),
+    'linear_svc': lambda classes: svm.LinearSVC(),
+    'random_forests': lambda classes: RandomForestClassifier(2, random_state=0),
+    'neural_networks': lambda classes: MLPClassifier(
+        solver='sgd', alpha=0.1, hidden_layer_sizes=(1000,), max_iter=100000),
+    'distances': NearestCentroid,
+    'gaussian': GaussianClasses,
+}
+
+
+def load_data(input_path):
+    d = profiled_store.load_profiled_data(input_path,
+                                          blocks=('norm_train', 'norm_test'))
+    obs_classes = profiling.get_obs_classes(d['samples_number'], 1,
+                                            d['classes'])
+
+    return {
+        'train': np.asarray(d['norm_train']),
+        'test': np.asarray(d['norm_test']),
+        'obs_classes': obs_classes.flatten().astype(int),
+        'classes': d['classes'],
+        'samples_number': d['samples_number'],
+    }
+
+
+def init_worker(data):
+    # With fork, the arrays are inherited from the parent, not copied
+    global _data
+    _data = data
+
+
+def scores_row(obs_classes, labels, traffic_classes):
+    classes = sorted(traffic_classes)
+    cm = confusion_matrix(obs_classes, labels, labels=classes)
+    tp, fn, fp, tn, precision, recall, accuracy = classification.binary_scores(
+        cm, MINING_CLASS_START, classes[-1])
+
+    return {
+        'tp': int(tp), 'fn': int(fn), 'fp': int(fp), 'tn': int(tn),
+        'precision': float(precision), 'recall': float(recall),
+        'accuracy': float(accuracy), 'confusion_matrix': cm.tolist()
+    }
+
+
+def evaluate(job):
+    """Fits one classifier and scores it for every aggregation setting"""
+    name, window_sizes, thresholds = job
+    obs_classes = _data['obs_classes']
+
+    clf = CLASSIFIERS[name](_data['classes'])
+    start = time.perf_counter()
+    clf.fit(_data['train'], obs_classes)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    labels = np.asarray(clf.predict(_data['test']))
+    windows_per_sec = len(labels) / (time.perf_counter() - start)
+
+    rows = []
+    for window_size in window_sizes:
+        # A single window aggregation does not depend on the threshold
+        for threshold in (thresholds if window_size > 1 else [None]):
+            y_test = labels if window_size == 1 else smoothing.smooth_history(
+                _data['samples_number'], labels, window_size, threshold)
+            row = {
+                'classifier': name,
+                'n_classes': len(_data['classes']),
+                'window_size': window_size,
+                'threshold': threshold,
+                'fit_time': fit_time,
+                'windows_per_sec': windows_per_sec,
+            }
+            row.update(scores_row(obs_classes, y_test, _data['classes']))
+            rows.append(row)
+
+    return rows
+
+
+def run_sweep(data, classifiers, window_sizes=WINDOW_SIZES,
+              thresholds=THRESHOLDS, n_jobs=None):
+    jobs = [(name, window_sizes, thresholds) for name in classifiers]
+    n_jobs = os.cpu_count() if n_jobs is None else n_jobs
+    n_jobs = max(1, min(n_jobs, len(jobs)))
+    results = []
+
+    with multiprocessing.Pool(n_jobs, init_worker, (data,)) as pool:
+        for rows in pool.imap_unordered(evaluate, jobs):
+            print('{}: fitted in {:.1f}s, {:.0f} windows/s'.format(
+                rows[0]['classifier'], rows[0]['fit_time'],
+                rows[0]['windows_per_sec']))
+            sys.stdout.flush()
+            results += rows
+
+    # Same order whatever the order the jobs finished in
+    order = {name: i for i, name in enumerate(classifiers)}
+    results.sort(key=lambda r: (order[r['classifier']], r['window_size'],
+                                r['threshold'] or 0))
+    return results
+
+
+def save_results(results, output_path):
+    if output_path.endswith('.csv'):
+        with open(output_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            for r in results:
+                writer.writerow(dict(r, confusion_matrix=json.dumps(
+                    r['confusion_matrix'])))
+    else:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', nargs='?',
+            help='profiled data store or pickle file (default: {}, or {} '
+                 'when there is no store)'.format(profiled_store.STORE_DIR,
+                                                  profiled_store.PICKLE_PATH))
+    parser.add_argument('-o', '--output', nargs='?', default='sweep.json',
+            help='results file, .json or .csv (default: sweep.json)')
+    parser.add_argument('-c', '--classifiers', nargs='+',
+            default=['svc', 'random_forests', 'distances', 'gaussian'],
+            choices=sorted(CLASSIFIERS),
+            help='classifiers to evaluate (default: svc random_forests '
+                 'distances gaussian)')
+    parser.add_argument('-w', '--windows', nargs='+', type=int,
+            default=WINDOW_SIZES,
+            help='window aggregation sizes, 1 is no aggregation '
+                 '(default: {})'.format(' '.join(map(str, WINDOW_SIZES))))
+    parser.add_argument('-t', '--thresholds', nargs='+', type=float,
+            default=THRESHOLDS,
+            help='window aggregation thresholds (default: {})'.format(
+                ' '.join(map(str, THRESHOLDS))))
+    parser.add_argument('-j', '--jobs', nargs='?', type=int,
+            help='worker processes (default: one per core)')
+    args = parser.parse_args()
+
+    if args.input is not None and not os.path.exists(args.input):
+        print('ERROR: Invalid profiled data file!')
+        exit(1)
+
+    results = run_sweep(load_data(args.input), args.classifiers, args.windows,
+                        args.thresholds, args.jobs)
+    save_results(results, args.output)
+    print('{} results -> {}'.format(len(results), args.output))
+
+
+if __name__ == '__main__':
+    main()
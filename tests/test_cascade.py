@@ -0,0 +1,78 @@
+import numpy as np
+from sklearn import svm
+from sklearn.ensemble import RandomForestClassifier
+import cascade
+import smoothing
+
+
+class Recorder:
+    """Wraps a model and records the inputs it predicts"""
+
+    def __init__(self, model):
+        self.model = model
+        self.inputs = []
+
+    def predict(self, x):
+        self.inputs.append(x)
+        return self.model.predict(x)
+
+
+def method_0_data():
+    rng = np.random.RandomState(0)
+    samples_number = [120, 80, 100]
+    classes = np.repeat([3, 13, 15], samples_number)
+    train = rng.normal(size=(classes.shape[0], 32)) + classes[:, np.newaxis] / 8
+    test = rng.normal(size=(classes.shape[0], 32)) + classes[:, np.newaxis] / 8
+
+    forest = RandomForestClassifier(2, max_depth=2, random_state=0) \
+        .fit(train, classes)
+    silence = svm.SVC(kernel='linear').fit(train[:, 24:32], classes)
+    return samples_number, test, forest, silence
+
+
+def test_cascade_matches_old_method_0():
+    samples_number, test, forest, silence = method_0_data()
+
+    # The method 0 of classification.main before it was a cascade
+    y_test_model1 = smoothing.smooth_history(samples_number,
+                                             list(forest.predict(test)))
+    possible_mining = [i for i, x in enumerate(y_test_model1) if x >= 13]
+    y_test_model2 = dict(enumerate(silence.predict(test[:, 24:32])))
+    expected = [y_test_model2[i] if i in possible_mining else y_test_model1[i]
+                for i in range(len(y_test_model1))]
+
+    second = Recorder(silence)
+    labels = cascade.run_cascade([
+        {
+            'model': forest,
+            'columns': slice(None),
+            'post': lambda labels: smoothing.smooth_history(samples_number,
+                                                            labels),
+        },
+        {
+            'model': second,
+            'columns': slice(24, 32),
+            'route': lambda labels: labels >= 13,
+        },
+    ], test)
+
+    assert list(labels) == expected
+    assert second.inputs[0].shape == (len(possible_mining), 8)
+
+
+def test_stages_get_only_their_rows_and_columns():
+    samples_number, test, forest, silence = method_0_data()
+    first = Recorder(forest)
+    second = Recorder(silence)
+
+    labels = cascade.run_cascade([
+        {'model': first},
+        {'model': second, 'columns': np.arange(24, 32),
+         'route': lambda labels: labels == 15},
+    ], test)
+
+    # Every row is routed to the first stage, which gets the matrix itself
+    assert np.shares_memory(first.inputs[0], test)
+    routed = np.flatnonzero(forest.predict(test) == 15)
+    assert np.array_equal(second.inputs[0], test[routed, 24:32])
+    assert np.array_equal(labels[routed], silence.predict(test[routed, 24:32]))
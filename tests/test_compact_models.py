@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.preprocessing import StandardScaler
+import compact_models
+
+
+def features(n_rows=500, n_features=40):
+    # Features of very different scales, as the profiled ones
+    rng = np.random.RandomState(0)
+    return rng.normal(size=(n_rows, n_features)) \
+        * np.logspace(-3, 4, n_features) + rng.normal(size=n_features)
+
+
+def test_projection_matches_scaler_and_pca():
+    x = features()
+    scaler = StandardScaler().fit(x)
+    pca = PCA(n_components=25, svd_solver='full').fit(scaler.transform(x))
+
+    projection = compact_models.export_projection(scaler, pca)
+    test = features(100)
+    np.testing.assert_allclose(test @ projection['weights']
+                               + projection['bias'],
+                               pca.transform(scaler.transform(test)),
+                               rtol=1e-9, atol=1e-9)
+    assert compact_models.check_projection(projection, scaler, pca, test)
+
+
+def test_projection_matches_incremental_models():
+    x = features()
+    scaler = StandardScaler()
+    pca = IncrementalPCA(n_components=25)
+    for s in (slice(0, 250), slice(250, 500)):
+        scaler.partial_fit(x[s])
+    for s in (slice(0, 250), slice(250, 500)):
+        pca.partial_fit(scaler.transform(x[s]))
+
+    projection = compact_models.export_projection(scaler, pca)
+    assert compact_models.check_projection(projection, scaler, pca, x)
+
+
+def test_check_projection_rejects_other_models():
+    x = features()
+    scaler = StandardScaler().fit(x)
+    pca = PCA(n_components=25, svd_solver='full').fit(scaler.transform(x))
+    other = StandardScaler().fit(x[:100] * 2)
+
+    projection = compact_models.export_projection(other, pca)
+    assert not compact_models.check_projection(projection, scaler, pca, x)
+
+
+def test_forest_matches_near_thresholds():
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.RandomState(0)
+    x = rng.normal(size=(300, 3))
+    y = (x[:, 0] > 0).astype(int)
+
+    for seed in range(20):
+        clf = RandomForestClassifier(1, max_depth=1, bootstrap=False,
+                                     random_state=seed).fit(x, y)
+        tree = clf.estimators_[0].tree_
+        threshold = tree.threshold[0]
+        # Largest float32 at most the threshold, and the float64 values just
+        # above the threshold that still round to it
+        below = np.float32(threshold)
+        if below > threshold:
+            below = np.nextafter(below, np.float32(-np.inf))
+        rounding = (np.float64(below)
+                    + np.float64(np.nextafter(below, np.float32(np.inf)))) / 2
+        if threshold < rounding:
+            break
+    assert threshold < rounding
+
+    near = x[:10].copy()
+    near[:, tree.feature[0]] = (threshold + rounding) / 2
+    model = compact_models.export_forest(clf)
+    assert np.array_equal(compact_models.predict(model, near),
+                          clf.predict(near))
+
+
+def classes_data(n_classes, n_rows=300, n_features=6):
+    # Overlapping blobs, so decisions near the boundaries are exercised
+    rng = np.random.RandomState(n_classes)
+    y = np.arange(n_rows) % n_classes
+    x = rng.normal(size=(n_rows, n_features)) + y[:, np.newaxis] * 0.8
+    return x, y * 3 + 1
+
+
+def check_export(clf):
+    for n_classes in (2, 4):
+        x, y = classes_data(n_classes)
+        clf.fit(x, y)
+        model = compact_models.export_model(clf)
+        assert np.array_equal(compact_models.predict(model, x), clf.predict(x))
+        assert compact_models.check_model(clf, model)
+
+
+def test_svc_matches():
+    from sklearn.svm import SVC
+    check_export(SVC(kernel='linear'))
+
+
+def test_linear_svc_matches():
+    from sklearn.svm import LinearSVC
+    check_export(LinearSVC())
+
+
+@pytest.mark.filterwarnings('ignore::sklearn.exceptions.ConvergenceWarning')
+def test_mlp_matches():
+    from sklearn.neural_network import MLPClassifier
+    for activation in ('relu', 'tanh', 'logistic'):
+        check_export(MLPClassifier(hidden_layer_sizes=(20,),
+                                   activation=activation, max_iter=300,
+                                   random_state=0))
+
+
+def test_rbf_svc_is_rejected():
+    from sklearn.svm import SVC
+    x, y = classes_data(2)
+    with pytest.raises(ValueError):
+        compact_models.export_model(SVC(kernel='rbf').fit(x, y))
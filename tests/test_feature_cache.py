@@ -0,0 +1,27 @@
+import numpy as np
+import feature_cache
+
+
+def test_dataset_hash_depends_on_merge_offsets(tmp_path):
+    paths = []
+    for name in ('a.dat', 'b.dat'):
+        path = tmp_path / name
+        path.write_text('1 2 3 4\n')
+        paths.append(str(path))
+
+    data = np.arange(16).reshape((4, 4))
+    shifted = np.roll(data, 1, axis=0)
+    h = feature_cache.dataset_hash(paths, data, [0, 0])
+
+    # Same files merged with other offsets are different samples
+    assert feature_cache.dataset_hash(paths, shifted, [0, 2]) != h
+    assert feature_cache.dataset_hash(paths, data, [0, 0]) == h
+    assert feature_cache.dataset_hash(paths, data) == h
+
+
+def test_cache_key_depends_on_params():
+    key = feature_cache.cache_key('x', offsets=[0, 0], obs_window=840)
+
+    assert feature_cache.cache_key('x', offsets=[0, 500],
+                                   obs_window=840) != key
+    assert feature_cache.cache_key('x', offsets=[0, 0], obs_window=840) == key
@@ -0,0 +1,85 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import model_registry
+import live_inference
+
+# Startup budget of a process importing the live path, and modules it must
+# not pull in
+IMPORT_TIME_BUDGET = 0.5  # seconds
+RSS_BUDGET = 64 << 20  # bytes
+HEAVY_MODULES = ('matplotlib', 'scipy', 'sklearn', 'profiling',
+                 'classification')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_startup():
+    """Import time, peak RSS and heavy modules of a fresh importing process.
+
+    The peak RSS is read from /proc, getrusage would report the one of the
+    forked pytest process when it is larger.
+    """
+    code = (
+        'import sys, time\n'
+        't = time.perf_counter()\n'
+        'import live_inference\n'
+        't = time.perf_counter() - t\n'
+        'status = open(\'/proc/self/status\').read().split(\'VmHWM:\')[1]\n'
+        'rss = int(status.split()[0]) * 1024\n'
+        'heavy = [m for m in {!r} if m in sys.modules]\n'
+        'print(t, rss, *heavy)\n'
+    ).format(HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=REPO_DIR).decode().split()
+
+    return float(output[0]), int(output[1]), output[2:]
+
+
+def test_startup_is_within_budget():
+    import_time, rss, heavy = measure_startup()
+
+    assert heavy == []
+    assert import_time < IMPORT_TIME_BUDGET
+    assert rss < RSS_BUDGET
+
+
+def write(path, mtime):
+    with open(path, 'wb') as f:
+        f.write(b'model')
+    os.utime(path, (mtime, mtime))
+
+
+def test_compact_model_older_than_its_source_is_not_used(tmp_path,
+                                                          monkeypatch):
+    monkeypatch.setattr(model_registry, 'MODEL_DIR', str(tmp_path))
+    write(str(tmp_path / 'classification_model.npz'), 1000)
+    write(str(tmp_path / 'classification_model.sav'), 2000)
+
+    assert not live_inference.model_current('classification_model.npz',
+                                            ('classification_model.sav',))
+
+    os.utime(str(tmp_path / 'classification_model.npz'), (2000, 2000))
+    assert live_inference.model_current('classification_model.npz',
+                                        ('classification_model.sav',))
+    assert not live_inference.model_current('missing.npz', ())
+
+
+def test_projection_is_checked_against_scaler_and_pca(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, 'MODEL_DIR', str(tmp_path))
+    np.savez(str(tmp_path / live_inference.PROJECTION_MODEL),
+             weights=np.eye(2), bias=np.ones(2))
+    os.utime(str(tmp_path / live_inference.PROJECTION_MODEL), (2000, 2000))
+    write(str(tmp_path / live_inference.SCALER_MODEL), 1000)
+    write(str(tmp_path / live_inference.PCA_MODEL), 3000)
+
+    sources = (live_inference.SCALER_MODEL, live_inference.PCA_MODEL)
+    assert not live_inference.model_current(live_inference.PROJECTION_MODEL,
+                                            sources)
+
+    os.utime(str(tmp_path / live_inference.PCA_MODEL), (1000, 1000))
+    assert live_inference.model_current(live_inference.PROJECTION_MODEL,
+                                        sources)
+    assert np.array_equal(
+        live_inference.normalize_live_features(np.zeros((3, 2))),
+        np.ones((3, 2)))
@@ -0,0 +1,82 @@
+import numpy as np
+import parse_packets
+
+
+def reference_bins(timestamps, directions, sizes, sample_delta):
+    """The original per-packet loop of process_packets, on arrays.
+
+    Direction 0 is a sent packet, 1 a received one. Rows are (received
+    bytes, sent bytes, received packets, sent packets).
+    """
+    rows = []
+    last_timestamp = None
+    last = {0: [0, 0], 1: [0, 0]}  # bytes, packets of each direction
+
+    def save(delta):
+        rows.append([last[1][0], last[0][0], last[1][1], last[0][1]])
+        rows.extend([[0, 0, 0, 0]] * (int(delta / sample_delta) - 1))
+
+    for ts, d, size in zip(timestamps, directions, sizes):
+        if last_timestamp is None:
+            last_timestamp = ts
+            last[d][0] += size
+            last[d][1] += 1
+            continue
+
+        time_delta = ts - last_timestamp
+        if time_delta > sample_delta:
+            save(time_delta)
+            last_timestamp = ts
+            last[d] = [size, 1]
+        else:
+            last[d][0] += size
+            last[d][1] += 1
+
+    save(0)
+    return np.array(rows, dtype=np.int64)
+
+
+def check(timestamps, directions, sizes, sample_delta=0.5):
+    bins = parse_packets.bin_packets(timestamps, directions, sizes,
+                                     sample_delta)
+    expected = reference_bins(timestamps, directions, sizes, sample_delta)
+    assert np.array_equal(bins, expected)
+
+
+def test_packets_exactly_sample_delta_apart():
+    # Exactly sample_delta after the interval start stays in the interval
+    check([0.0, 0.5, 1.0, 1.5, 2.5, 3.0], [0, 1, 0, 1, 1, 0],
+          [100, 200, 300, 400, 500, 600])
+
+
+def test_single_direction_runs_carry_over():
+    # Received counters are not reset by intervals started by sent packets
+    check([0.0, 0.1, 0.7, 0.8, 1.4, 2.0, 2.05, 4.0],
+          [1, 1, 0, 0, 0, 1, 1, 0], [10, 20, 30, 40, 50, 60, 70, 80])
+    check([0.0, 0.6, 1.2, 5.0], [0, 0, 0, 0], [1, 2, 3, 4])
+    check([0.0, 0.6, 1.2, 5.0], [1, 1, 1, 1], [1, 2, 3, 4])
+
+
+def test_gap_rows():
+    check([0.0, 0.51, 3.0, 3.2, 10.01], [0, 1, 1, 0, 1], [5, 6, 7, 8, 9])
+
+
+def test_randomized_traces():
+    rng = np.random.RandomState(0)
+
+    for trace in range(500):
+        n = rng.randint(1, 60)
+        # A mix of bursts, gaps and packets on the 0.25s grid, some of them
+        # exactly sample_delta apart
+        steps = rng.choice([0.0, 0.01, 0.25, 0.5, 0.5, 0.75, 1.0, 2.3], n)
+        steps[0] = rng.choice([0.0, 1e9])
+        timestamps = np.cumsum(steps)
+        if rng.rand() < 0.5:
+            timestamps += rng.uniform(0, 0.05, n).cumsum()
+        directions = rng.randint(0, 2, n)
+        if rng.rand() < 0.2:
+            directions[:] = rng.randint(0, 2)
+        sizes = rng.randint(40, 1500, n)
+
+        check(timestamps.tolist(), directions, sizes,
+              rng.choice([0.5, 0.25, 1.0]))
@@ -0,0 +1,137 @@
+import struct
+import pytest
+import pcap_reader
+
+SRC4, DST4 = bytes([10, 0, 0, 1]), bytes([93, 184, 216, 34])
+SRC6 = bytes.fromhex('20010db8000000000000000000000001')
+DST6 = bytes.fromhex('20010db8000000000000000000000002')
+
+
+def tcp(src_port, dst_port):
+    # Ports, sequence and ack numbers, data offset 5, flags, window, checksum
+    return struct.pack('>HHIIBBHHH', src_port, dst_port, 0, 0, 0x50, 0x10,
+                       1024, 0, 0)
+
+
+def ipv4(src, dst, payload, proto=6, fragment=0):
+    return struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 0,
+                       fragment, 64, proto, 0, src, dst) + payload
+
+
+def ipv6(src, dst, payload, next_header=6):
+    return struct.pack('>IHBB16s16s', 6 << 28, len(payload), next_header, 64,
+                       src, dst) + payload
+
+
+def ethernet(payload, ethertype, vlans=()):
+    header = b'\x02' * 6 + b'\x04' * 6
+    for vlan in vlans:
+        header += struct.pack('>HH', 0x8100, vlan)
+    return header + struct.pack('>H', ethertype) + payload
+
+
+def pcap(packets, magic=b'\xd4\xc3\xb2\xa1', resolution=10 ** 6,
+         linktype=pcap_reader.LINKTYPE_ETHERNET):
+    data = magic + struct.pack('<HHiIII', 2, 4, 0, 0, 65535, linktype)
+    for seconds, frac, frame in packets:
+        data += struct.pack('<IIII', seconds, frac, len(frame), len(frame))
+        data += frame
+    return data
+
+
+def pcapng_block(block_type, body):
+    body += b'\x00' * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack('<II', block_type, length) + body \
+        + struct.pack('<I', length)
+
+
+def pcapng(packets, tsresol=None, linktype=pcap_reader.LINKTYPE_ETHERNET):
+    shb = pcapng_block(pcap_reader.PCAPNG_SHB, struct.pack(
+        '<IHHq', pcap_reader.PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1))
+    options = b''
+    if tsresol is not None:
+        options = struct.pack('<HHB3x', pcap_reader.PCAPNG_OPT_TSRESOL, 1,
+                              tsresol) + struct.pack('<HH', 0, 0)
+    idb = pcapng_block(pcap_reader.PCAPNG_IDB,
+                       struct.pack('<HHI', linktype, 0, 65535) + options)
+
+    data = shb + idb
+    for ts, frame in packets:
+        data += pcapng_block(pcap_reader.PCAPNG_EPB, struct.pack(
+            '<IIIII', 0, ts >> 32, ts & 0xFFFFFFFF, len(frame), len(frame))
+            + frame)
+    return data
+
+
+def read(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return list(pcap_reader.read_tcp_packets(str(path)))
+
+
+def test_pcap_microseconds(tmp_path):
+    frame = ethernet(ipv4(SRC4, DST4, tcp(50000, 3333)),
+                     pcap_reader.ETHERTYPE_IPV4)
+    packets = read(tmp_path, 'us.pcap', pcap([(10, 250000, frame)]))
+
+    assert packets == [(10.25, SRC4, DST4, 50000, 3333, 40)]
+
+
+def test_pcap_nanoseconds(tmp_path):
+    frame = ethernet(ipv4(DST4, SRC4, tcp(3333, 50000) + b'x' * 60),
+                     pcap_reader.ETHERTYPE_IPV4)
+    packets = read(tmp_path, 'ns.pcap',
+                   pcap([(10, 500000001, frame)], magic=b'\x4d\x3c\xb2\xa1'))
+
+    assert packets == [(10 + 500000001 / 1e9, DST4, SRC4, 3333, 50000, 100)]
+
+
+def test_pcapng_tsresol_and_headers(tmp_path):
+    # Hop-by-hop options header (8 bytes) before the TCP header
+    hop_by_hop = bytes([6, 0]) + b'\x01\x04\x00\x00\x00\x00'
+    frames = [
+        ethernet(ipv4(SRC4, DST4, tcp(50000, 3333)),
+                 pcap_reader.ETHERTYPE_IPV4, vlans=(10,)),
+        ethernet(ipv6(SRC6, DST6, hop_by_hop + tcp(50001, 443),
+                      next_header=0), pcap_reader.ETHERTYPE_IPV6),
+        # Not the first fragment, there is no TCP header to read
+        ethernet(ipv4(SRC4, DST4, b'\x00' * 20, fragment=185),
+                 pcap_reader.ETHERTYPE_IPV4),
+        ethernet(ipv4(SRC4, DST4, b'\x00' * 8, proto=17),
+                 pcap_reader.ETHERTYPE_IPV4),
+    ]
+    # if_tsresol 9, nanoseconds
+    ts = 1500000000 * 10 ** 9 + 123456789
+    packets = read(tmp_path, 'a.pcapng', pcapng(
+        [(ts + i, frame) for i, frame in enumerate(frames)], tsresol=9))
+
+    assert packets == [
+        (1500000000 + 123456789 / 1e9, SRC4, DST4, 50000, 3333, 40),
+        (1500000000 + 123456790 / 1e9, SRC6, DST6, 50001, 443, 28),
+    ]
+
+
+def test_pcapng_binary_tsresol(tmp_path):
+    frame = ethernet(ipv4(SRC4, DST4, tcp(50000, 3333)),
+                     pcap_reader.ETHERTYPE_IPV4)
+    # if_tsresol 0x80 | 10, 1/1024 s
+    packets = read(tmp_path, 'b.pcapng',
+                   pcapng([(3 * 1024 + 512, frame)], tsresol=0x8A))
+
+    assert packets == [(3.5, SRC4, DST4, 50000, 3333, 40)]
+
+
+def test_pcapng_default_resolution_raw_ip(tmp_path):
+    packets = read(tmp_path, 'c.pcapng', pcapng(
+        [(2000001, ipv4(SRC4, DST4, tcp(1, 2)))],
+        linktype=pcap_reader.LINKTYPE_RAW))
+
+    assert packets == [(2.000001, SRC4, DST4, 1, 2, 40)]
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / 'x.pcap'
+    path.write_bytes(b'not a capture')
+    with pytest.raises(ValueError):
+        list(pcap_reader.read_tcp_packets(str(path)))
@@ -0,0 +1,73 @@
+import numpy as np
+from collections import Counter
+import smoothing
+
+
+def old_aggregation_window(window, threshold):
+    num_class = {k: v for k, v in Counter(window).items()}
+    max_repetition = max(num_class, key=num_class.get)
+
+    if num_class[max_repetition] / len(window) > threshold:
+        return [max_repetition for i in range(len(window))]
+
+    return window
+
+
+def old_history(traffic_samples, labels, window_size, threshold):
+    # The per-block loop improve_classification_history used to run
+    labels = list(labels)
+    for ts in traffic_samples:
+        i = 0
+        while i + window_size < ts:
+            labels[i:i + window_size] = old_aggregation_window(
+                labels[i:i + window_size], threshold)
+            i += window_size
+
+        if ts - i > 0:
+            labels[i:ts] = old_aggregation_window(labels[i:ts], threshold)
+
+    return labels
+
+
+def test_smooth_history_matches_old_loop():
+    rng = np.random.RandomState(0)
+
+    for case in range(300):
+        n = rng.randint(1, 400)
+        # Runs of a dominant label with noise, so some blocks are replaced
+        labels = np.repeat(rng.randint(0, 14, n // 10 + 1), 10)[:n]
+        noise = rng.rand(n) < rng.uniform(0, 0.6)
+        labels[noise] = rng.randint(0, 14, np.count_nonzero(noise))
+        traffic_samples = np.sort(rng.randint(1, n + 1, rng.randint(1, 5)))
+        window_size = int(rng.choice([1, 3, 10, 40]))
+        threshold = float(rng.choice([0.3, 0.55, 0.6, 0.9]))
+
+        assert smoothing.smooth_history(traffic_samples, labels.tolist(),
+                                        window_size, threshold) == \
+            old_history(traffic_samples, labels.tolist(), window_size,
+                        threshold)
+
+
+def test_majority_smoother_matches_counter():
+    rng = np.random.RandomState(1)
+
+    for case in range(100):
+        window_size = int(rng.choice([1, 5, 40]))
+        threshold = float(rng.choice([0.3, 0.5, 0.6]))
+        labels = rng.randint(0, 4, 300)
+        smoother = smoothing.MajoritySmoother(window_size, threshold)
+
+        for i, label in enumerate(labels):
+            window = labels[max(0, i - window_size + 1):i + 1]
+            counts = Counter(window.tolist())
+            above = {l: c for l, c in counts.items()
+                     if c / len(window) > threshold}
+            # Below 0.5 several labels can be above threshold, any of the
+            # most frequent ones is a majority
+            expected = [label] if len(above) == 0 else \
+                [l for l, c in above.items() if c == max(above.values())]
+
+            assert smoother.push(label) in expected
+
+        smoother.reset()
+        assert smoother.push(labels[0]) == labels[0]
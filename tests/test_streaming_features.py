@@ -0,0 +1,61 @@
+import numpy as np
+import window_features
+import live_inference
+from streaming_features import SlidingWindowFeatures, combine_windows
+
+
+def flow(n_samples, seed=0):
+    # Byte and packet counts with silent stretches and some empty windows
+    rng = np.random.RandomState(seed)
+    active = rng.rand(n_samples) < 0.4
+    data = rng.randint(0, 1500, (n_samples, 4)) * active[:, np.newaxis]
+    data[n_samples // 3:n_samples // 3 + 200] = 0
+    return data.astype(np.float64)
+
+
+def batch_features(data, obs_window, slide_window, scales):
+    windows = window_features.break_train_test(
+        data, obs_window, slide_window, train_percentage=0.0,
+        random_split=False)[1]
+    empty_windows, features = window_features.extract_features(windows)
+
+    return empty_windows, features, \
+        window_features.extract_features_silence(windows, empty_windows), \
+        window_features.extract_features_wavelet(windows, empty_windows,
+                                                 scales)
+
+
+def assert_same_features(a, b):
+    assert np.array_equal(a[0], b[0])
+    for x, y in zip(a[1:], b[1:]):
+        assert x.shape == y.shape
+        np.testing.assert_allclose(x, y, rtol=1e-9, atol=1e-9)
+
+
+def test_uneven_pushes_match_batch_features():
+    data = flow(1200)
+    engine = SlidingWindowFeatures(4, 240, 40, [2, 4])
+    results = []
+    start = 0
+    for size in [1, 39, 41, 0, 200, 7, 400, 300, 212]:
+        results.append(engine.push(data[start:start + size]))
+        start += size
+    assert start == len(data)
+
+    n_obs_windows = int((len(data) - 240) / 40)
+    assert_same_features(combine_windows(results, n_obs_windows),
+                         batch_features(data, 240, 40, [2, 4]))
+
+
+def test_live_features_match_engine():
+    for n_samples in (1200, 300):
+        data = flow(n_samples, seed=n_samples)
+        engine = SlidingWindowFeatures(4, 840, 40, [2, 4]) \
+            if n_samples > 840 else \
+            SlidingWindowFeatures(4, n_samples, n_samples, [2, 4])
+        n_obs_windows = int((n_samples - 840) / 40) \
+            if n_samples > 840 else None
+        expected = combine_windows([engine.push(data)], n_obs_windows)
+
+        features = live_inference.extract_live_features(data)
+        assert_same_features((expected[0],) + tuple(features), expected)
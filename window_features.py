@@ -0,0 +1,148 @@
+import numpy as np
+import scalogram
+
+# Number of observation windows whose features are computed at once
+WINDOWS_CHUNK = 512
+
+
+def observation_windows(data, obs_window=840, slide_window=40):
+    """Returns the (windows x obs_window x columns) observation windows.
+
+    The windows are a strided, read-only view over data, no sample is copied.
+    """
+    n_obs_windows = max(int((len(data) - obs_window) / slide_window), 0)
+    windows = np.lib.stride_tricks.sliding_window_view(
+        data, obs_window, axis=0)[::slide_window]
+
+    return windows[:n_obs_windows].transpose(0, 2, 1)
+
+
+def train_test_indices(n_obs_windows, train_percentage=0.5, random_split=True):
+    order = np.random.permutation(n_obs_windows) \
+        if random_split else np.arange(n_obs_windows)
+
+    n_train_windows = int(n_obs_windows * train_percentage)
+    return order[:n_train_windows], order[n_train_windows:]
+
+
+def break_train_test(data, obs_window=840, slide_window=40,
+                     train_percentage=0.5, random_split=True):
+    if len(data) <= obs_window:
+        return np.array([data]), np.array([data])
+
+    data_obs = observation_windows(data, obs_window, slide_window)
+    train_idx, test_idx = train_test_indices(
+        data_obs.shape[0], train_percentage, random_split)
+
+    # Sequential splits are views over data, only random ones are copied
+    if not random_split:
+        return data_obs[:len(train_idx)], data_obs[len(train_idx):]
+
+    return data_obs[train_idx], data_obs[test_idx]
+
+
+def window_chunks(n_obs_windows, chunk_size=None):
+    # Windows are processed in blocks to bound the memory of the temporaries
+    chunk_size = WINDOWS_CHUNK if chunk_size is None else chunk_size
+    for start in range(0, n_obs_windows, chunk_size):
+        yield slice(start, min(start + chunk_size, n_obs_windows))
+
+
+def extract_features(data):
+    percentils = [75, 90, 95]
+    n_obs_windows, n_samples, n_cols = data.shape
+    features = [np.zeros((0, n_cols * (3 + len(percentils))))]
+    empty_windows = np.zeros(n_obs_windows, dtype=bool)
+
+    for chunk in window_chunks(n_obs_windows):
+        windows = np.asarray(data[chunk], dtype=np.float64)
+        mean = np.mean(windows, axis=1)
+        empty = (mean[:, 2] == 0.0) & (mean[:, 3] == 0.0)
+        empty_windows[chunk] = empty
+
+        # The median is the 50th percentile, one partition gives all of them
+        windows = windows[~empty]
+        quantiles = np.percentile(windows, [50] + percentils, axis=1)
+        features.append(np.hstack((
+            mean[~empty],
+            quantiles[0],
+            np.std(windows, axis=1),
+            quantiles[1:].transpose(1, 2, 0).reshape((windows.shape[0], -1)),
+        )))
+
+    return empty_windows, np.vstack(features)
+
+
+def extract_silence(data, threshold=256):
+    # Run starts/ends are the rising/falling edges of the silence mask
+    silent = np.concatenate(([0], np.asarray(data) <= threshold, [0]))
+    edges = np.diff(silent.astype(np.int8))
+    s = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+
+    return s[1:-1] if len(s) > 2 else np.array([0])
+
+
+def silence_statistics(data, threshold=256):
+    """Mean and variance of the silence runs of every row of data.
+
+    Same as np.mean/np.var of extract_silence for each row: the first and
+    last runs are discarded and rows with less than 3 runs get zeros.
+    """
+    n_rows, n_samples = data.shape
+    silent = np.zeros((n_rows, n_samples + 2), dtype=np.int8)
+    silent[:, 1:-1] = data <= threshold
+    edges = np.diff(silent, axis=1)
+
+    # Runs come out row by row, in order, since nonzero scans in C order
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    lengths = ends - starts
+
+    n_runs = np.bincount(rows, minlength=n_rows)
+    first_run = np.concatenate(([0], np.cumsum(n_runs)[:-1]))
+    n_inner = n_runs - 2
+
+    # Rows with the same number of runs are reduced together, which keeps
+    # the summation order (and so the values) of np.mean/np.var
+    mean = np.zeros(n_rows)
+    var = np.zeros(n_rows)
+    for k in np.unique(n_inner[n_inner > 0]):
+        k_rows = np.flatnonzero(n_inner == k)
+        runs = lengths[first_run[k_rows, np.newaxis] + 1 + np.arange(k)]
+        mean[k_rows] = np.sum(runs, axis=1) / k
+        deviations = runs - mean[k_rows, np.newaxis]
+        var[k_rows] = np.sum(deviations * deviations, axis=1) / k
+
+    return mean, var
+
+
+def extract_features_silence(data, empty_windows, threshold=0):
+    n_obs_windows, n_samples, n_cols = data.shape
+    features = [np.zeros((0, 2 * n_cols))]
+
+    for chunk in window_chunks(n_obs_windows):
+        windows = data[chunk][~empty_windows[chunk]]
+        n_windows = windows.shape[0]
+
+        # One row per (window, column) pair
+        series = windows.transpose(0, 2, 1).reshape((n_windows * n_cols, -1))
+        mean, var = silence_statistics(series, threshold)
+        features.append(np.stack((mean, var), axis=1)
+                        .reshape((n_windows, 2 * n_cols)))
+
+    return np.vstack(features)
+
+
+def extract_features_wavelet(data, empty_windows, scales=[2, 4, 8, 16, 32]):
+    n_obs_windows, n_samples, n_cols = data.shape
+    features = [np.zeros((0, len(scales) * n_cols))]
+
+    for chunk in window_chunks(n_obs_windows):
+        windows = data[chunk][~empty_windows[chunk]]
+
+        # Scalograms of every (window, column) series in a single transform
+        scalo, fscales = scalogram.scalogramCWT(
+            windows.transpose(0, 2, 1), scales)
+        features.append(scalo.reshape((windows.shape[0], -1)))
+
+    return np.vstack(features)